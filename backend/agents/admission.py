@@ -0,0 +1,91 @@
+from contextlib import asynccontextmanager
+from typing import Dict
+import asyncio
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+#Runs requests for the same thread one at a time, in arrival order, and caps how many agent runs
+#(model calls and tool waits) are in flight overall. Instead of piling up, a request is rejected
+#right away with 429 when its thread already has a full queue and with 503 when no run slot frees up in time
+class AdmissionControl:
+    def __init__(self, max_in_flight: int = 32, max_per_thread: int = 2, wait_timeout: float = 1.0, retry_after: int = 2):
+        # max_per_thread: running plus queued requests allowed for one thread
+        # wait_timeout: how long a request whose turn it is waits for a free run slot
+        self.max_in_flight = max_in_flight
+        self.max_per_thread = max_per_thread
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._counts: Dict[str, int] = {}
+        self.in_flight = 0
+        self.rejected = {429: 0, 503: 0}
+
+    def _reject(self, status_code: int, detail: str):
+        self.rejected[status_code] += 1
+        raise Overloaded(status_code, detail, self.retry_after)
+
+    def _leave(self, thread_id: str):
+        self._counts[thread_id] -= 1
+        if not self._counts[thread_id]:
+            del self._counts[thread_id]
+            del self._locks[thread_id]
+
+    def check(self, thread_id: str):
+        '''Raise Overloaded now if a request for thread_id would be rejected, without taking anything'''
+        if self._counts.get(thread_id, 0) >= self.max_per_thread:
+            self._reject(429, "Another request for this conversation is still running")
+        if self.in_flight >= self.max_in_flight:
+            self._reject(503, "Server is busy, try again shortly")
+
+    async def acquire(self, thread_id: str):
+        '''Wait for the thread's turn and a run slot, raises Overloaded instead of waiting too long'''
+        if self._counts.get(thread_id, 0) >= self.max_per_thread:
+            self._reject(429, "Another request for this conversation is still running")
+        self._counts[thread_id] = self._counts.get(thread_id, 0) + 1
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._leave(thread_id)
+            raise
+        try:
+            # only the request whose turn it is takes a slot, queued ones don't hold any
+            await asyncio.wait_for(self._slots.acquire(), self.wait_timeout)
+        except BaseException as e:
+            lock.release()
+            self._leave(thread_id)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "Server is busy, try again shortly")
+            raise
+        self.in_flight += 1
+
+    def release(self, thread_id: str):
+        self.in_flight -= 1
+        self._slots.release()
+        self._locks[thread_id].release()
+        self._leave(thread_id)
+
+    @asynccontextmanager
+    async def admit(self, thread_id: str):
+        await self.acquire(thread_id)
+        try:
+            yield
+        finally:
+            self.release(thread_id)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": sum(self._counts.values()) - self.in_flight,
+            "rejected_429": self.rejected[429],
+            "rejected_503": self.rejected[503],
+        }
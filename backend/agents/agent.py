@@ -3,80 +3,174 @@ from langgraph.graph import StateGraph, MessagesState, START, END
 from langgraph.prebuilt import ToolNode
 from langgraph.checkpoint.memory import MemorySaver
 from langchain.tools import tool
-from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
+from langchain_core.messages import HumanMessage, ToolMessage, AIMessage, AIMessageChunk, SystemMessage
+from langchain_core.language_models.chat_models import BaseChatModel
+from agents.images import expand_screenshots
+from agents.toolset import compact_schema, tool_notes_message, TOOL_NOTES_ID
 from dotenv import load_dotenv
+import hashlib
+import json
+import time
 import os 
 load_dotenv()
 
 #Response is now an array of messages!
 
 
+#identifies a model and the arguments bound to it (tool schemas, tool_choice) for the response cache
+def model_scope(llm,bound_kwargs) -> str:
+    # look through wrappers like the gateway's to the model that actually answers
+    model = llm.model if isinstance(getattr(llm,"model",None),BaseChatModel) else llm
+    name = getattr(model,"model_name",None) or getattr(model,"model",None) or type(model).__name__
+    payload = json.dumps({"model": str(name),"bound": bound_kwargs},sort_keys=True,default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+#messages of a run shown to the client, the tool notes are only for the model
+def visible(messages) -> list:
+    return [message for message in messages if message.id != TOOL_NOTES_ID]
+
+
+#answers every tool call the thread is paused on with a decline, so the model asks the user what to do instead
+def _declined_messages(state) -> list:
+    return [
+        ToolMessage(content="Tool use declined by user: user is unhappy with tool selection, ask for follow up to get more information!",
+                    tool_call_id=tool["id"])
+    for tool in state["messages"][-1].tool_calls]
+
+
 #Wrapper class for agent that can pause and resume conversations
 class Agent:
     #initialize the graph, 
-    def __init__(self,tools):
-        if not os.getenv("OPENAI_API_KEY"):
-            raise ValueError("Must specify OpenAI key in .env")
-        self.llm = ChatOpenAI(model="gpt-4o-mini",api_key=os.getenv("OPENAI_API_KEY")).bind_tools(tools)
+    #on_tool_calls is an optional async callback (thread_id, tool_calls) awaited as the tools node starts,
+    #used to push tool requests to the client so results can arrive while the tools wait for them
+    #blob_store resolves screenshot references, screenshots_in_prompt is how many recent screenshots are shown as images
+    #context_manager (agents.context.ContextManager) shapes long histories before they are sent to the model
+    #checkpointer stores the conversation state, in memory by default. It is the only copy of the history,
+    #each turn only sends the new message
+    #system_prompt is put in front of the history on every model call instead of being stored in it
+    #llm is the chat model to use, gpt-4o-mini by default. With a gateway (agents.llm.LLMGateway) every call
+    #goes through its shared rate limiter, retries and hedging
+    #response_cache (agents.cache.ResponseCache) answers a prompt the model has already seen without calling it
+    #compact_tools binds only the first paragraph of each tool's docstring, the rest (return formats, examples)
+    #is added to each thread once as a system note
+    #tool_selector (agents.toolset.ToolSelector) is called with (messages, tool names) before each model call
+    #and returns the names of the tools to offer for that step
+    #approval_policy (agents.approval.ApprovalPolicy) lets tool calls that don't need consent run without
+    #pausing for /approve, without one every tool call waits for approval
+    #tool_node runs the tool calls, a langgraph ToolNode over tools by default (agents.parallel.ParallelToolNode
+    #adds a thread pool and a deadline per step)
+    #recorder (agents.recorder.SessionRecorder) writes each thread's messages and model calls to disk for replay
+    def __init__(self,tools,on_tool_calls=None,blob_store=None,screenshots_in_prompt=1,context_manager=None,checkpointer=None,system_prompt=None,llm=None,gateway=None,response_cache=None,compact_tools=False,tool_selector=None,approval_policy=None,tool_node=None,recorder=None):
+        if llm is None:
+            if not os.getenv("OPENAI_API_KEY"):
+                raise ValueError("Must specify OpenAI key in .env")
+            # the gateway does the retrying
+            llm = ChatOpenAI(model="gpt-4o-mini",api_key=os.getenv("OPENAI_API_KEY"),max_retries=0 if gateway else 2)
+        self.gateway = gateway
+        self.tool_names = [t.name for t in tools]
+        self.tool_schemas = {t.name: compact_schema(t) if compact_tools else t for t in tools}
+        self.tool_notes = tool_notes_message(tools) if compact_tools else None
+        self.tool_selector = tool_selector
+        self.approval_policy = approval_policy
+        self.use_llm(llm)
+        self.context_manager = context_manager
+        self.response_cache = response_cache
+        self.recorder = recorder
+        self.system_prompt = system_prompt
         # create the agent loop
-        def invoke_model(state:MessagesState):
-            import json
-            messages = state["messages"].copy()
-            # Work backwards through consecutive ToolMessages to find take_screenshot
-            for i in range(len(messages) - 1, -1, -1):
-                msg = messages[i]
-
-                if hasattr(msg, 'name'):  # It's a ToolMessage
-                    if msg.name == 'take_screenshot' and hasattr(msg, 'content'):
-                        # Parse the JSON content which includes both screenshot and viewport
-                        try:
-                            screenshot_data = json.loads(msg.content)
-                            screenshot_base64 = screenshot_data.get('screenshot', msg.content)
-                            viewport = screenshot_data.get('viewport', {})
-                        except (json.JSONDecodeError, TypeError):
-                            # Fallback to old format (just base64 string)
-                            screenshot_base64 = msg.content
-                            viewport = {}
-
-                        # Format the screenshot and viewport info for the LLM
-                        content = [
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{screenshot_base64}"}
-                            }
-                        ]
-
-                        # Add viewport information as text
-                        if viewport:
-                            viewport_text = f"Viewport dimensions: {viewport['width']}x{viewport['height']} pixels"
-                            content.append({
-                                "type": "text",
-                                "text": viewport_text
-                            })
-
-                        messages.append(HumanMessage(content=content))
-                        break
-                    # Continue looking backwards for more ToolMessages
-                else:
-                    # Hit a non-ToolMessage, stop looking
-                    break
-
-            resp = self.llm.invoke(messages)
-            return {"messages": [resp]}
+        def with_system_prompt(messages):
+            # threads started before the prompt moved out of the history already begin with it
+            if self.system_prompt and not (messages and isinstance(messages[0],SystemMessage)):
+                return [SystemMessage(content=self.system_prompt)] + messages
+            return messages
+
+        def prepare_messages(messages):
+            # Only the latest screenshots are sent as images, older ones stay as short references
+            return expand_screenshots(messages,blob_store,keep=screenshots_in_prompt)
+
+        def plan_call(state,messages):
+            #returns the prompt, the model bound to this step's tools, its cache scope and the messages to add before the response
+            notes = []
+            if self.tool_notes and not any(m.id == TOOL_NOTES_ID for m in state["messages"]):
+                # stored in the thread where it is first sent, so later prompts keep the same prefix
+                notes = [self.tool_notes]
+            messages = messages + notes
+            names = self.tool_selector(messages,self.tool_names) if self.tool_selector else self.tool_names
+            llm,scope = self.llm_for_tools(names)
+            return prepare_messages(messages),llm,scope,notes
+
+        # the graph is only run with astream, so the model call doesn't block the event loop
+        async def invoke_model(state:MessagesState,config):
+            messages = with_system_prompt(state["messages"])
+            if self.context_manager:
+                messages = await self.context_manager.ashape(messages,config["configurable"]["thread_id"])
+            messages,llm,scope,notes = plan_call(state,messages)
+            key = self.response_cache.key(scope,messages) if self.response_cache else None
+            started = time.monotonic()
+            resp = self.response_cache.get(key) if key else None
+            cached = resp is not None
+            if resp is None:
+                resp = await llm.ainvoke(messages)
+                if key:
+                    self.response_cache.put(key,resp)
+            if self.recorder:
+                self.recorder.model(config["configurable"]["thread_id"],messages,resp,time.monotonic() - started,cached)
+            return {"messages": notes + [resp]}
         
-        def should_continue(state:MessagesState):
-            return True if hasattr(state["messages"][-1],"tool_calls") and state["messages"][-1].tool_calls else False
+        def should_continue(state:MessagesState,config):
+            tool_calls = getattr(state["messages"][-1],"tool_calls",None)
+            if not tool_calls:
+                return END
+            # "tools" interrupts for approval, "auto_tools" runs the same tools straight away
+            if self.approval_policy and not self.approval_policy.needs_consent(config["configurable"]["thread_id"],tool_calls):
+                return "auto_tools"
+            return "tools"
         
-        #llm can either call tools or end
+        tool_node = tool_node or ToolNode(tools)
+        self.tool_node = tool_node
+        async def run_tools(state:MessagesState,config):
+            if on_tool_calls:
+                await on_tool_calls(config["configurable"]["thread_id"],state["messages"][-1].tool_calls)
+            return await tool_node.ainvoke(state,config)
+
+        #llm can either call tools, with or without approval, or end
         graph = StateGraph(MessagesState)
         graph.add_edge(START,"get_response")
         graph.add_node("get_response",invoke_model)
-        graph.add_node("tools",ToolNode(tools))
-        graph.add_conditional_edges("get_response",should_continue,{True: "tools",False: END})
+        graph.add_node("tools",run_tools)
+        graph.add_node("auto_tools",run_tools)
+        graph.add_conditional_edges("get_response",should_continue,["tools","auto_tools",END])
         graph.add_edge("tools","get_response")
-
-        memory = MemorySaver()
-        self.agent = graph.compile(checkpointer=memory,interrupt_before=["tools"])
+        graph.add_edge("auto_tools","get_response")
+
+        self.graph = graph
+        self.use_checkpointer(checkpointer or MemorySaver())
+
+    #swap the chat model, e.g. for a scripted one in benchmarks. It goes behind the agent's gateway like the original
+    def use_llm(self,llm):
+        self.base_llm = self.gateway.wrap(llm) if self.gateway else llm
+        # bound model and cache scope per set of offered tools
+        self._bindings = {}
+        self.llm,self.cache_scope = self.llm_for_tools(self.tool_names)
+
+    #the model bound to a subset of the tools, in the order they were given, and its response cache scope
+    def llm_for_tools(self,names):
+        names = tuple(name for name in self.tool_names if name in set(names))
+        if names not in self._bindings:
+            llm = self.base_llm.bind_tools([self.tool_schemas[name] for name in names]) if names else self.base_llm
+            # a cached response is only valid for the same model and tools
+            self._bindings[names] = (llm,model_scope(self.base_llm,getattr(llm,"kwargs",{})))
+        return self._bindings[names]
+
+    #swap where conversation state is kept, e.g. for a SQLite checkpointer that can only be opened inside the event loop
+    def use_checkpointer(self,checkpointer):
+        self.agent = self.graph.compile(checkpointer=checkpointer,interrupt_before=["tools"])
+
+    #what the client sent, with the model calls and tool results it is enough to replay the thread
+    def record(self,payload,data):
+        if self.recorder:
+            self.recorder.user(payload["config"]["configurable"]["thread_id"],data)
     '''
         {
             config: ...
@@ -86,51 +180,73 @@ class Agent:
     '''
     async def clear_history(self,thread_id) -> list:
         await self.agent.checkpointer.adelete_thread(thread_id)
+        if self.context_manager:
+            self.context_manager.forget(thread_id)
         return []
-    def resume_with_approved_tools(self,payload):
+    #the graph's nodes are async, so every entry point is too
+    async def ahas_pending_tools(self,config) -> bool:
+        #whether the thread is paused waiting for tool calls to be approved or declined
+        snapshot = await self.agent.aget_state(config)
+        return bool(snapshot.next)
+    async def aresume_with_approved_tools(self,payload):
+        self.record(payload,"Approve")
         extended = []
-        for event in self.agent.stream(None, payload["config"], stream_mode="updates"):
+        async for event in self.agent.astream(None, payload["config"], stream_mode="updates"):
             for _,update in event.items():
-                if "messages" in update: extended.extend(update["messages"]) 
+                if "messages" in update: extended.extend(visible(update["messages"]))
         return extended
-    def resume_with_declined_tools(self,payload):
-        snapshot = self.agent.get_state(payload["config"])
-        old_hist = snapshot.values["messages"]
-        declined_tools = [
-            ToolMessage(content="Tool use declined by user: user is unhappy with tool selection, ask for follow up to get more information!",
-                        tool_call_id=tool["id"])
-        for tool in old_hist[-1].tool_calls]
-        # old_hist[-1].tool_calls = []
-        # newhist = old_hist + declined_tools 
-
-        self.agent.update_state(payload["config"],{"messages": declined_tools})
+    async def _adecline(self,payload):
+        self.record(payload,"Disapprove")
+        snapshot = await self.agent.aget_state(payload["config"])
+        # as if the tools node had run, the graph continues with the model
+        await self.agent.aupdate_state(payload["config"],{"messages": _declined_messages(snapshot.values)},as_node="tools")
+    async def aresume_with_declined_tools(self,payload):
+        await self._adecline(payload)
         extended = []
-        for event in self.agent.stream(None,payload["config"],stream_mode="updates"):
+        async for event in self.agent.astream(None,payload["config"],stream_mode="updates"):
             for _,update in event.items():
-                if "messages" in update: extended.extend(update["messages"])
+                if "messages" in update: extended.extend(visible(update["messages"]))
         return extended
 
-    def get_response(self,payload,history=[]):
+    async def aget_response(self,payload):
         if not payload["data"]:
             return []
-        last_event = None
         if payload["data"] not in ("Approve","Disapprove"):
+            self.record(payload,payload["data"])
             input_message = HumanMessage(content=payload["data"])
-            history.append(input_message)
             extended = []
-            for event in self.agent.stream({"messages": history},payload["config"],stream_mode="updates"):
+            async for event in self.agent.astream({"messages": [input_message]},payload["config"],stream_mode="updates"):
                 for _,update in event.items():
-                    if "messages" in update: extended.extend(update["messages"])
-                last_event = event
-            # remaining = last_event["messages"][-1]
-            snapshot = self.agent.get_state(payload["config"])
-            assert(snapshot.next, "Error in the exeuction flow")
-            result = "Tool call intention: \n"
-            if snapshot.values["messages"][-1].tool_calls:
-                for tool in  snapshot.values["messages"][-1].tool_calls:
-                    result += f"f{tool["name"]} | {tool["args"]}\n"
-                # remaining +=  [AIMessage(content=result)]
+                    if "messages" in update: extended.extend(visible(update["messages"]))
             return extended
+
+    #streaming versions, yielding ("token", AIMessageChunk) as the model generates
+    #and ("message", message) for every message a node adds to the state
+    async def _astream(self,graph_input,config):
+        async for mode,chunk in self.agent.astream(graph_input,config,stream_mode=["messages","updates"]):
+            if mode == "messages":
+                message,metadata = chunk
+                if isinstance(message,AIMessageChunk) and message.content and metadata.get("langgraph_node") == "get_response":
+                    yield "token",message
+            else:
+                for _,update in chunk.items():
+                    if update and "messages" in update:
+                        for message in visible(update["messages"]):
+                            yield "message",message
+    async def astream_response(self,payload):
+        if not payload["data"] or payload["data"] in ("Approve","Disapprove"):
+            return
+        self.record(payload,payload["data"])
+        async for event in self._astream({"messages": [HumanMessage(content=payload["data"])]},payload["config"]):
+            yield event
+    async def astream_approved_tools(self,payload):
+        self.record(payload,"Approve")
+        async for event in self._astream(None,payload["config"]):
+            yield event
+    async def astream_declined_tools(self,payload):
+        await self._adecline(payload)
+        async for event in self._astream(None,payload["config"]):
+            yield event
     def format_message_history(self,response) -> str:
         """Format the agent's message history into a readable string"""
 
@@ -180,19 +296,17 @@ class Agent:
 #     return str(x - y)
 
 # agent = Agent([add,subtract])
-# conversation_history = []
 # while True: 
 #     inp = input("You: ")
 #     payload = {
 #         "config": config,
 #         "data" : inp,
 #     }
-#     result =  agent.get_response(payload,conversation_history)
+#     result =  asyncio.run(agent.aget_response(payload))
 #     if not result:
 #         print("Invalid Input!")
 #     else:
 #         print(agent.format_message_history(result))
-#     conversation_history += result
     
 
 
@@ -0,0 +1,44 @@
+from typing import Optional, Callable, Dict, Iterable
+
+READ_ONLY = "read_only"
+MUTATING = "mutating"
+DANGEROUS = "dangerous"
+
+
+#Decides which tool calls need the user's approval. Each tool has a level: read only tools only
+#look at the page or the user's files, mutating ones change the page and dangerous ones can do anything.
+#Calls whose levels are all in auto_approve run without pausing, dangerous ones always ask
+class ApprovalPolicy:
+    def __init__(self, levels: Dict[str, str], auto_approve: Iterable[str] = (READ_ONLY,), default: str = MUTATING,
+                 available: Optional[Callable[[str, str], bool]] = None):
+        # levels: tool name -> level, tools not listed get default
+        # available(thread_id, tool_name): whether the tool can run right now without the user,
+        # e.g. browser tools only when the extension has a channel open to receive the request
+        self.levels = levels
+        self.auto_approve = set(auto_approve) - {DANGEROUS}
+        self.default = default
+        self.available = available or (lambda thread_id, name: True)
+        self.auto_approved = 0
+        self.interrupted = 0
+
+    def level(self, name: str) -> str:
+        return self.levels.get(name, self.default)
+
+    def needs_consent(self, thread_id: str, tool_calls: list) -> bool:
+        '''One call needing consent pauses the whole batch, so the user approves it at once'''
+        consent = any(
+            self.level(call["name"]) not in self.auto_approve or not self.available(thread_id, call["name"])
+            for call in tool_calls
+        )
+        if consent:
+            self.interrupted += 1
+        else:
+            self.auto_approved += 1
+        return consent
+
+    def stats(self) -> dict:
+        return {
+            "auto_approve": sorted(self.auto_approve),
+            "auto_approved_batches": self.auto_approved,
+            "interrupted_batches": self.interrupted,
+        }
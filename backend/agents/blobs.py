@@ -0,0 +1,120 @@
+from typing import Optional, Dict, Set, Union
+import threading
+import hashlib
+import os
+import re
+
+
+KEY_PATTERN = re.compile(rb"sha256:[0-9a-f]{64}")
+
+
+def blob_refs(data: Union[bytes, str, None]) -> Set[str]:
+    '''Blob keys mentioned anywhere in data, e.g. a serialized checkpoint'''
+    if not data:
+        return set()
+    if isinstance(data, str):
+        data = data.encode("utf-8", "surrogatepass")
+    return {match.decode() for match in KEY_PATTERN.findall(data)}
+
+
+#Content addressed storage for large tool payloads (screenshots) so history only has to keep a short reference.
+#Identical content is stored once no matter how many messages, checkpoints or threads refer to it.
+#Blobs put with an owner (a thread id) are deleted once every thread that stored them has been released.
+#Owners are only kept in memory, after a restart rebuild() reads them back from the stored histories
+class BlobStore:
+    def __init__(self, directory: Optional[str] = None):
+        # with a directory blobs live on disk, otherwise they are kept in memory
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, bytes] = {}
+        # key -> threads that stored it, and the other way round
+        self._owners: Dict[str, Set[str]] = {}
+        self._owned: Dict[str, Set[str]] = {}
+        self.deleted = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.split(":", 1)[1])
+
+    def put(self, data: bytes, owner: Optional[str] = None) -> str:
+        key = "sha256:" + hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if owner is not None:
+                self._owners.setdefault(key, set()).add(owner)
+                self._owned.setdefault(owner, set()).add(key)
+            if not self.directory:
+                self._blobs.setdefault(key, data)
+                return key
+            # under the lock so a release can't delete the file between the check and the write
+            path = self._path(key)
+            if not os.path.exists(path):
+                # write to a temp name first so a reader never sees a partial blob
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        return key
+
+    def release(self, owner: str) -> int:
+        '''Drop the owner's claim on its blobs and delete the ones no other owner stored. Returns how many were deleted'''
+        deleted = 0
+        with self._lock:
+            for key in self._owned.pop(owner, set()):
+                owners = self._owners.get(key)
+                owners.discard(owner)
+                if owners:
+                    continue
+                del self._owners[key]
+                if not self.directory:
+                    self._blobs.pop(key, None)
+                else:
+                    try:
+                        os.remove(self._path(key))
+                    except FileNotFoundError:
+                        pass
+                deleted += 1
+            self.deleted += deleted
+        return deleted
+
+    def rebuild(self, references: Dict[str, Set[str]]) -> int:
+        '''Replace the owners with references (thread id -> keys its stored history refers to) and delete the
+        blobs no thread refers to, e.g. ones of threads that were dropped while the server was down.
+        Only for stores where every blob is put with an owner. Returns how many were deleted'''
+        with self._lock:
+            self._owners, self._owned = {}, {}
+            for owner, keys in references.items():
+                for key in keys:
+                    self._owners.setdefault(key, set()).add(owner)
+                    self._owned.setdefault(owner, set()).add(key)
+            if not self.directory:
+                stale = [key for key in self._blobs if key not in self._owners]
+                for key in stale:
+                    del self._blobs[key]
+            else:
+                stored = ["sha256:" + name for name in os.listdir(self.directory) if KEY_PATTERN.fullmatch(b"sha256:" + name.encode())]
+                stale = [key for key in stored if key not in self._owners]
+                for key in stale:
+                    try:
+                        os.remove(self._path(key))
+                    except FileNotFoundError:
+                        pass
+            self.deleted += len(stale)
+        return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"owned_blobs": len(self._owners), "owners": len(self._owned), "deleted": self.deleted}
+
+    def get(self, key: str) -> Optional[bytes]:
+        digest = key[len("sha256:"):]
+        if not key.startswith("sha256:") or len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        if not self.directory:
+            with self._lock:
+                return self._blobs.get(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
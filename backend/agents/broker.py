@@ -0,0 +1,91 @@
+from concurrent.futures import Future
+from typing import Optional, Dict
+import asyncio
+import threading
+import time
+
+
+class _PendingCall:
+    def __init__(self):
+        self.future: Future = Future()
+        self.created = time.monotonic()
+        self.waiting = False
+
+
+#Hands client computed tool results to the tool that is waiting on them.
+#Every tool_call_id gets its own future, so results can never be delivered to the wrong tool
+#and a waiting tool wakes up as soon as /completeTool arrives instead of polling
+class ToolResultBroker:
+    def __init__(self, ttl: float = 300):
+        # results nobody picked up (or waits nobody answered) are dropped after ttl seconds
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _PendingCall] = {}
+
+    def _get_or_create(self, tool_call_id: str) -> _PendingCall:
+        call = self._pending.get(tool_call_id)
+        if call is None:
+            call = _PendingCall()
+            self._pending[tool_call_id] = call
+        return call
+
+    def _prune(self):
+        # caller holds the lock
+        now = time.monotonic()
+        expired = [
+            tool_call_id for tool_call_id, call in self._pending.items()
+            if not call.waiting and now - call.created > self.ttl
+        ]
+        for tool_call_id in expired:
+            self._pending.pop(tool_call_id).future.cancel()
+
+    def _register(self, tool_call_id: str) -> _PendingCall:
+        with self._lock:
+            self._prune()
+            call = self._get_or_create(tool_call_id)
+            call.waiting = True
+        return call
+
+    def _release(self, tool_call_id: str, call: _PendingCall):
+        with self._lock:
+            if self._pending.get(tool_call_id) is call:
+                del self._pending[tool_call_id]
+
+    async def await_result(self, tool_call_id: str, timeout: float = 30) -> Optional[str]:
+        '''Suspend until the result for tool_call_id is completed, cancelled or timeout passes'''
+        call = self._register(tool_call_id)
+        try:
+            # shield so a timeout here doesn't cancel the shared future out from under complete()
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call.future)), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.CancelledError:
+            # the call was cancelled through the broker, otherwise our own task is being cancelled
+            if call.future.cancelled():
+                return None
+            raise
+        finally:
+            self._release(tool_call_id, call)
+
+    def complete(self, tool_call_id: str, result: str) -> bool:
+        '''Deliver a result, waking the waiting tool. Results that arrive first are kept until ttl'''
+        with self._lock:
+            self._prune()
+            call = self._get_or_create(tool_call_id)
+            if call.future.done():
+                return False
+            call.future.set_result(result)
+            return True
+
+    def cancel(self, tool_call_id: str) -> bool:
+        '''Abandon a tool call, waking its waiter with None and dropping any early result'''
+        with self._lock:
+            call = self._pending.pop(tool_call_id, None)
+        if call is None:
+            return False
+        return call.future.cancel() or call.future.done()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
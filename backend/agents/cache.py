@@ -0,0 +1,107 @@
+from langchain_core.messages import AIMessage, ToolMessage, message_to_dict, messages_from_dict
+from collections import OrderedDict
+from typing import Optional, Dict
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import uuid
+
+
+def normalize_messages(messages: list) -> list:
+    '''What identifies a prompt: message types, content and tool calls, without message ids.
+    Tool call ids are random per run, they are replaced by their order of appearance'''
+    ids: Dict[str, str] = {}
+
+    def call_id(tool_call_id):
+        return ids.setdefault(tool_call_id, f"call_{len(ids)}")
+
+    normalized = []
+    for message in messages:
+        content = message.content.strip() if isinstance(message.content, str) else message.content
+        entry = {"type": message.type, "content": content}
+        if isinstance(message, AIMessage) and message.tool_calls:
+            entry["tool_calls"] = [{"name": call["name"], "args": call["args"], "id": call_id(call["id"])} for call in message.tool_calls]
+        if isinstance(message, ToolMessage):
+            entry["tool_call_id"] = call_id(message.tool_call_id)
+            entry["name"] = message.name
+        normalized.append(entry)
+    return normalized
+
+
+def fresh_copy(message: AIMessage) -> AIMessage:
+    '''A cached response with new message and tool call ids, ids have to stay unique within a thread'''
+    tool_calls = [{**call, "id": f"call_{uuid.uuid4().hex[:24]}"} for call in message.tool_calls]
+    return message.model_copy(update={"id": f"run-{uuid.uuid4()}", "tool_calls": tool_calls})
+
+
+#Exact match cache of model responses, keyed on the prompt, the bound tools and the model.
+#Kept in an in-memory LRU, optionally backed by a SQLite file so it survives restarts
+class ResponseCache:
+    def __init__(self, max_entries: int = 512, ttl: float = 24 * 3600, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires, serialized message), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, message TEXT NOT NULL, expires REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+
+    def key(self, scope: str, messages: list) -> str:
+        '''scope identifies the model and its bound tools'''
+        payload = json.dumps([scope, normalize_messages(messages)], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _remember(self, key: str, expires: float, message: str):
+        # caller holds the lock
+        self._entries[key] = (expires, message)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[AIMessage]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] < now:
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT expires, message FROM responses WHERE key = ? AND expires >= ?", (key, now)).fetchone()
+                if row:
+                    entry = row
+                    self._remember(key, *row)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return fresh_copy(messages_from_dict([json.loads(entry[1])])[0])
+
+    def put(self, key: str, message: AIMessage):
+        if not isinstance(message, AIMessage) or message.invalid_tool_calls:
+            return
+        expires = time.time() + self.ttl
+        serialized = json.dumps(message_to_dict(message))
+        with self._lock:
+            self._remember(key, expires, serialized)
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, serialized, expires))
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "entries": len(self._entries),
+            }
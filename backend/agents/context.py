@@ -0,0 +1,180 @@
+from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage, AIMessage
+from collections import OrderedDict
+from typing import Optional, Dict
+import threading
+import hashlib
+import json
+import sys
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+#Token counts of recently counted texts. Keyed by a digest so the cache doesn't keep the texts
+#(page listings, resumes) alive, and bounded by the memory its entries take
+class TokenCounts:
+    # dict slot and linked list node of the OrderedDict, per entry
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, max_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def _entry_size(self, digest: bytes, count: int) -> int:
+        return sys.getsizeof(digest) + sys.getsizeof(count) + self.ENTRY_OVERHEAD
+
+    def count(self, text: str) -> int:
+        digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self._lock:
+            count = self._counts.get(digest)
+            if count is not None:
+                self._counts.move_to_end(digest)
+                return count
+        count = len(_encoding.encode(text, disallowed_special=()))
+        with self._lock:
+            if digest not in self._counts:
+                self._counts[digest] = count
+                self.size += self._entry_size(digest, count)
+            while self.size > self.max_bytes and self._counts:
+                old_digest, old_count = self._counts.popitem(last=False)
+                self.size -= self._entry_size(old_digest, old_count)
+        return count
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._counts)
+
+
+_token_counts = TokenCounts()
+
+
+def count_text_tokens(text: str) -> int:
+    if _encoding is None:
+        # rough estimate when tiktoken or its encoding file isn't available
+        return len(text) // 4 + 1
+    return _token_counts.count(text)
+
+
+def count_tokens(message) -> int:
+    '''Approximate prompt tokens for a message, including tool call arguments'''
+    content = message.content
+    if isinstance(content, list):
+        text = " ".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    else:
+        text = str(content)
+    tokens = 4 + count_text_tokens(text)
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tokens += count_text_tokens(json.dumps([[call["name"], call.get("args", {})] for call in message.tool_calls]))
+    return tokens
+
+
+SUMMARY_PROMPT = '''You maintain a running summary of a job application assistant's session.
+Update the summary with the new messages below. Keep every fact that is still needed to finish the
+application: values already entered into which fields, answers the user gave, open questions and
+the current page/step. Be concise, plain text only.'''
+
+
+#Shapes the history sent to the model so each call stays roughly the same size as a session grows.
+#The checkpoint keeps the full history, only the prompt is shaped
+class ContextManager:
+    def __init__(self, max_tokens: int = 24000, recent_tokens: int = 8000, min_recent_messages: int = 6,
+                 stub_tokens: int = 120, summary_llm=None):
+        # max_tokens: history size that triggers shaping
+        # recent_tokens / min_recent_messages: tail of the conversation always kept verbatim
+        # stub_tokens: older tool results bigger than this are collapsed to a one line stub
+        # summary_llm: optional chat model, when set older turns are folded into a cached running summary
+        self.max_tokens = max_tokens
+        self.recent_tokens = recent_tokens
+        self.min_recent_messages = min_recent_messages
+        self.stub_tokens = stub_tokens
+        self.summary_llm = summary_llm
+        self._lock = threading.Lock()
+        # thread_id -> (number of older messages summarized, id of the last one, summary)
+        self._summaries: Dict[str, tuple] = {}
+
+    def _split(self, messages: list):
+        '''Split into leading system prompt, older messages and recent messages'''
+        start = 0
+        while start < len(messages) and isinstance(messages[start], SystemMessage):
+            start += 1
+
+        cut = len(messages)
+        budget = 0
+        while cut > start:
+            budget += count_tokens(messages[cut - 1])
+            if budget > self.recent_tokens and len(messages) - cut >= self.min_recent_messages:
+                break
+            cut -= 1
+        # the recent part can't start with tool results, they have to follow the AIMessage that called them
+        while start < cut < len(messages) and isinstance(messages[cut], ToolMessage):
+            cut -= 1
+        return messages[:start], messages[start:cut], messages[cut:]
+
+    def _stub(self, message):
+        if isinstance(message, ToolMessage) and count_tokens(message) > self.stub_tokens:
+            first_line = str(message.content).strip().split("\n", 1)[0][:80]
+            return ToolMessage(
+                content=f"[earlier {message.name} result omitted ({count_tokens(message)} tokens), starts with: {first_line}]",
+                tool_call_id=message.tool_call_id,
+                name=message.name,
+                id=message.id
+            )
+        return message
+
+    def _pending_summary(self, thread_id: str, older: list):
+        '''Previous summary and the older messages that aren't part of it yet'''
+        with self._lock:
+            summarized, last_id, summary = self._summaries.get(thread_id, (0, None, ""))
+        if summarized > len(older) or (summarized and older[summarized - 1].id != last_id):
+            # history was cleared or rewritten, start over
+            summarized, summary = 0, ""
+        return summarized, summary, older[summarized:]
+
+    def _summary_request(self, summary: str, new_messages: list) -> list:
+        lines = [f"{type(message).__name__}: {self._stub(message).content}" for message in new_messages]
+        return [
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n" + "\n".join(lines))
+        ]
+
+    def _store_summary(self, thread_id: str, older: list, summary: str):
+        with self._lock:
+            self._summaries[thread_id] = (len(older), older[-1].id, summary)
+
+    def _plan(self, messages: list, thread_id: str):
+        '''Returns (system, older, summary, unsummarized older messages, recent, whether to summarize them first)'''
+        system, older, recent = self._split(messages)
+        if self.summary_llm is None:
+            return system, older, "", older, recent, False
+        summarized, summary, pending = self._pending_summary(thread_id, older)
+        shaped = system + self._layout(summary, pending) + recent
+        # only fold more into the summary once the shaped prompt is over budget again
+        needs_summary = bool(pending) and sum(count_tokens(message) for message in shaped) > self.max_tokens
+        return system, older, summary, pending, recent, needs_summary
+
+    def _layout(self, summary: str, pending: list) -> list:
+        note = [SystemMessage(content=f"Summary of the earlier part of this session:\n{summary}")] if summary else []
+        return note + [self._stub(message) for message in pending]
+
+    async def ashape(self, messages: list, thread_id: str) -> list:
+        if sum(count_tokens(message) for message in messages) <= self.max_tokens:
+            return messages
+        system, older, summary, pending, recent, needs_summary = self._plan(messages, thread_id)
+        if needs_summary:
+            summary = (await self.summary_llm.ainvoke(self._summary_request(summary, pending))).content
+            self._store_summary(thread_id, older, summary)
+            pending = []
+        return system + self._layout(summary, pending) + recent
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._summaries)
+
+    def forget(self, thread_id: str):
+        with self._lock:
+            self._summaries.pop(thread_id, None)
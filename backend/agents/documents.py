@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict
+import threading
+import hashlib
+import shutil
+import time
+import os
+
+# uploads docling turns into markdown, anything else is stored as is
+CONVERTIBLE_EXTENSIONS = {".pdf", ".docx", ".pptx", ".xlsx", ".html", ".htm", ".png", ".jpg", ".jpeg", ".tiff", ".bmp"}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, text: str):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+#Converts uploaded documents to markdown in the background with one long lived docling converter.
+#Results are cached by content hash so the same document is only ever converted once
+class DocumentPipeline:
+    def __init__(self, cache_dir: str = "converted", job_ttl: float = 3600, max_jobs: int = 256):
+        # finished jobs are forgotten after job_ttl seconds, and the oldest of them once there are more than max_jobs
+        self.cache_dir = cache_dir
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        os.makedirs(cache_dir, exist_ok=True)
+        # a single worker, docling's models are heavy and conversions run one at a time anyway
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="docling")
+        self._lock = threading.Lock()
+        self._converter = None
+        # job id (the document's sha256) -> job status
+        self._jobs: Dict[str, dict] = {}
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.md")
+
+    def _get_converter(self):
+        # loading docling's models takes seconds, only done on the first conversion
+        if self._converter is None:
+            from docling.document_converter import DocumentConverter
+            self._converter = DocumentConverter()
+        return self._converter
+
+    def _publish(self, digest: str, target: Optional[str]):
+        if target:
+            # copy through a temp file so readers of the target never see half of it
+            tmp_path = f"{target}.{threading.get_ident()}.tmp"
+            shutil.copyfile(self._cache_path(digest), tmp_path)
+            os.replace(tmp_path, target)
+
+    def _evict(self):
+        '''Drop finished jobs past their ttl or over the cap, queued and running ones are always kept. Call with the lock held'''
+        now = time.time()
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished:
+            if now - self._jobs[job_id]["finished"] > self.job_ttl:
+                del self._jobs[job_id]
+        finished = [job_id for job_id in finished if job_id in self._jobs]
+        # oldest first, jobs are re-inserted when submitted again
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def _update(self, digest: str, **changes):
+        with self._lock:
+            # a job can be replaced by a newer submit of the same document while it runs
+            if digest in self._jobs:
+                self._jobs[digest].update(changes)
+
+    def _convert(self, digest: str, path: str, target: Optional[str]):
+        self._update(digest, status="running", started=time.time())
+        try:
+            if not os.path.exists(self._cache_path(digest)):
+                markdown = self._get_converter().convert(source=path).document.export_to_markdown()
+                write_atomic(self._cache_path(digest), markdown)
+            self._publish(digest, target)
+            self._update(digest, status="done", finished=time.time())
+        except Exception as e:
+            self._update(digest, status="failed", error=str(e), finished=time.time())
+
+    def submit(self, path: str, target: Optional[str] = None, digest: Optional[str] = None) -> dict:
+        '''Queue the conversion of path, the markdown is also copied to target when done.
+        Pass digest if the content hash is already known'''
+        digest = digest or file_sha256(path)
+        job = {"id": digest, "file": os.path.basename(path), "target": target, "cached": False, "error": None,
+               "created": time.time(), "started": None, "finished": None}
+        with self._lock:
+            current = self._jobs.get(digest)
+            if current and current["status"] in ("queued", "running") and current["target"] == target:
+                return dict(current)
+            self._jobs.pop(digest, None)
+            if os.path.exists(self._cache_path(digest)):
+                # converted before, nothing to wait for
+                job.update(status="done", cached=True, finished=job["created"])
+                self._jobs[digest] = job
+            else:
+                job["status"] = "queued"
+                self._jobs[digest] = job
+            self._evict()
+        if job["cached"]:
+            self._publish(digest, target)
+        else:
+            self._executor.submit(self._convert, digest, path, target)
+        return dict(job)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
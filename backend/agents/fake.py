@@ -0,0 +1,83 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from agents.context import count_tokens, count_text_tokens
+from agents.images import is_screenshot_message
+from typing import List, Optional
+import asyncio
+import random
+import time
+import json
+import uuid
+
+
+#Chat model that plays a script instead of calling an API, for benchmarks and offline runs.
+#turns is a list of turns, each a list of steps {"tool_calls": [{"name", "args"}], "content": ..., "latency": ...}.
+#The step is picked from the conversation itself (which user message, how many model replies since),
+#so any number of threads can share one model. Past the end of a turn it answers with final_content.
+#prompts, the user message of each turn, lets the turn be found by its text when older user messages
+#are missing from the prompt (context summaries)
+class ScriptedChatModel(BaseChatModel):
+    turns: List[List[dict]]
+    prompts: Optional[List[str]] = None
+    latency: float = 0.0
+    jitter: float = 0.0
+    final_content: str = "Done."
+    model_name: str = "scripted"
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        # keep the formatted tools as call arguments so anything keyed on them sees the real schemas
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def turn_index(self, messages: list, humans: list) -> int:
+        index = min(len(humans), len(self.turns)) - 1
+        if self.prompts and humans:
+            text = messages[humans[-1]].content
+            matches = [i for i, prompt in enumerate(self.prompts) if prompt == text]
+            # summaries only ever remove user messages, so the turn is at least the one counted
+            index = next((i for i in matches if i >= index), matches[-1] if matches else index)
+        return min(index, len(self.turns) - 1)
+
+    def step(self, messages: list) -> dict:
+        # screenshot images are sent as HumanMessages too, only messages from the user start a turn
+        humans = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage) and not is_screenshot_message(message)]
+        turn = self.turns[self.turn_index(messages, humans)] if humans and self.turns else []
+        replies = sum(isinstance(message, AIMessage) for message in messages[humans[-1] if humans else 0:])
+        return turn[replies] if replies < len(turn) else {"content": self.final_content}
+
+    def _reply(self, messages: list) -> ChatResult:
+        step = self.step(messages)
+        tool_calls = [
+            {"name": call["name"], "args": call.get("args", {}), "id": f"call_{uuid.uuid4().hex[:24]}"}
+            for call in step.get("tool_calls", [])
+        ]
+        content = step.get("content", "")
+        # usage as if it were a real call, so token budgets and reports have something to count
+        input_tokens = sum(count_tokens(message) for message in messages)
+        output_tokens = count_text_tokens(content + json.dumps([[call["name"], call["args"]] for call in tool_calls]))
+        message = AIMessage(
+            content=content,
+            tool_calls=tool_calls,
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter)
+
+    def _delay_for(self, messages: list) -> float:
+        # a step can carry its own latency, e.g. the one recorded for it
+        return self.step(messages).get("latency", self._delay())
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay_for(messages))
+        return self._reply(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay_for(messages))
+        return self._reply(messages)
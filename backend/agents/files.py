@@ -0,0 +1,67 @@
+from typing import Dict, Optional, Tuple
+import threading
+import os
+
+
+#The user's uploaded files (resume, application answers) as the server side tools return them.
+#Each file is read again only when its mtime or size changes, and a thread that already got the
+#current version of a file gets a short pointer to the earlier result instead of the whole text again.
+#What a thread was given is dropped with forget(thread_id), called when the session is evicted
+class FileToolCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> ((mtime_ns, size), text)
+        self._files: Dict[str, Tuple[tuple, str]] = {}
+        # thread_id -> {path: signature last returned in full}
+        self._returned: Dict[str, Dict[str, tuple]] = {}
+        self.reads = 0
+        self.hits = 0
+        self.pointers = 0
+
+    def read(self, path: str) -> Tuple[str, tuple]:
+        '''Text and signature of the file, raises FileNotFoundError like open()'''
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached and cached[0] == signature:
+                self.hits += 1
+                return cached[1], signature
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with self._lock:
+            self.reads += 1
+            self._files[path] = (signature, text)
+        return text, signature
+
+    def result(self, thread_id: str, tool_name: str, path: str, full: bool = False) -> str:
+        '''What the tool returns: the file's text, or a pointer when the thread already has this version'''
+        text, signature = self.read(path)
+        with self._lock:
+            returned = self._returned.setdefault(thread_id, {})
+            if not full and returned.get(path) == signature:
+                self.pointers += 1
+                return (f"Same as your earlier {tool_name} result, {path} hasn't changed since. "
+                        f"Call {tool_name} with full=true if you no longer have it.")
+            returned[path] = signature
+        return text
+
+    def forget(self, thread_id: str):
+        with self._lock:
+            self._returned.pop(thread_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._returned)
+
+    def stats(self) -> dict:
+        # counts since startup, the per thread state is what's held now
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "threads": len(self._returned),
+                "thread_entries": sum(len(returned) for returned in self._returned.values()),
+                "reads_total": self.reads,
+                "hits_total": self.hits,
+                "pointers_total": self.pointers,
+            }
@@ -0,0 +1,174 @@
+from PIL import Image
+from langchain_core.messages import HumanMessage, ToolMessage
+from typing import Optional, Dict
+from agents.blobs import BlobStore
+import threading
+import hashlib
+import base64
+import json
+import io
+
+
+def pixel_digest(image: Image.Image) -> str:
+    '''Digest of the decoded pixels, the same for the same picture however the client encoded it.
+    Any visible change counts, a typed character or a toggled checkbox is often all a step changes'''
+    digest = hashlib.sha256(f"{image.mode}{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+#Shrinks client screenshots before they reach the model and notices when the page hasn't changed
+class ScreenshotCompactor:
+    def __init__(self, max_edge: int = 1280, format: str = "JPEG", quality: int = 75,
+                 blob_store: Optional[BlobStore] = None):
+        # with a blob_store the image is stored there and the result only carries a screenshot_ref
+        self.blob_store = blob_store
+        self.max_edge = max_edge
+        self.format = format.upper()
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._last_hash: Dict[str, str] = {}
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.format.lower()}"
+
+    def encode(self, image: Image.Image) -> str:
+        if max(image.size) > self.max_edge:
+            image = image.copy()
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+        if self.format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.format, quality=self.quality)
+        return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    def compact(self, thread_id: str, raw: str) -> str:
+        '''
+        Takes the take_screenshot result from the client ({"screenshot": base64, "viewport": {...}} or bare base64)
+        and returns the same JSON with a downscaled, re-encoded image, or {"unchanged": true, ...} when
+        the screenshot is pixel for pixel the same as the previous one for this thread
+        '''
+        try:
+            data = json.loads(raw)
+        except (json.JSONDecodeError, TypeError):
+            data = {"screenshot": raw}
+        if not isinstance(data, dict) or not data.get("screenshot"):
+            return raw
+
+        screenshot = data["screenshot"]
+        if "base64," in screenshot:
+            screenshot = screenshot.split("base64,")[1]
+        try:
+            image = Image.open(io.BytesIO(base64.b64decode(screenshot)))
+            image.load()
+        except Exception:
+            # leave anything we can't decode for the model to deal with as before
+            return raw
+
+        image_hash = pixel_digest(image)
+        with self._lock:
+            previous = self._last_hash.get(thread_id)
+            self._last_hash[thread_id] = image_hash
+        result = {"viewport": data.get("viewport", {})}
+        if previous == image_hash:
+            result["unchanged"] = True
+            result["note"] = "Screenshot unchanged since the previous screenshot"
+            return json.dumps(result)
+
+        encoded = self.encode(image)
+        if max(image.size) <= self.max_edge and image.format and len(screenshot) < len(encoded):
+            # already small enough and the original encoding is tighter (flat UIs often are as PNG)
+            encoded = screenshot
+            result["mime_type"] = f"image/{image.format.lower()}"
+        else:
+            result["mime_type"] = self.mime_type
+        if self.blob_store:
+            # owned by the thread, deleted with it when it is evicted
+            result["screenshot_ref"] = self.blob_store.put(base64.b64decode(encoded), owner=thread_id)
+        else:
+            result["screenshot"] = encoded
+        return json.dumps(result)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._last_hash)
+
+    def forget(self, thread_id: str):
+        with self._lock:
+            self._last_hash.pop(thread_id, None)
+
+
+def screenshot_content(content, blob_store: Optional[BlobStore] = None) -> Optional[list]:
+    '''Turn a take_screenshot ToolMessage content into image content blocks for the model, None if there is no image'''
+    try:
+        screenshot_data = json.loads(content)
+        if not isinstance(screenshot_data, dict):
+            raise TypeError
+    except (json.JSONDecodeError, TypeError):
+        # Fallback to old format (just base64 string)
+        screenshot_data = {"screenshot": content}
+    if screenshot_data.get("unchanged"):
+        return None
+
+    screenshot = screenshot_data.get("screenshot")
+    if not screenshot and blob_store and screenshot_data.get("screenshot_ref"):
+        data = blob_store.get(screenshot_data["screenshot_ref"])
+        screenshot = base64.b64encode(data).decode("ascii") if data else None
+    if not screenshot:
+        return None
+
+    mime_type = screenshot_data.get("mime_type", "image/jpeg")
+    blocks = [
+        {
+            "type": "image_url",
+            "image_url": {"url": f"data:{mime_type};base64,{screenshot}"}
+        }
+    ]
+    viewport = screenshot_data.get("viewport", {})
+    # Add viewport information as text
+    if viewport:
+        blocks.append({
+            "type": "text",
+            "text": f"Viewport dimensions: {viewport['width']}x{viewport['height']} pixels"
+        })
+    return blocks
+
+
+# id prefix of the messages carrying screenshot images, they are part of the prompt but not something the user said
+SCREENSHOT_MESSAGE_ID = "screenshot-"
+
+
+def is_screenshot_message(message) -> bool:
+    return isinstance(message, HumanMessage) and str(message.id or "").startswith(SCREENSHOT_MESSAGE_ID)
+
+
+def expand_screenshots(messages: list, blob_store: Optional[BlobStore] = None, keep: int = 1) -> list:
+    '''
+    Attach the images of the last `keep` take_screenshot results as HumanMessages for the model.
+    Each image goes right after the run of ToolMessages its screenshot is part of, since
+    tool results have to directly follow the AIMessage that called them
+    '''
+    # unchanged screenshots carry no image, so they don't count towards keep
+    expand = {}
+    for i in range(len(messages) - 1, -1, -1):
+        if len(expand) >= keep:
+            break
+        msg = messages[i]
+        if isinstance(msg, ToolMessage) and msg.name == 'take_screenshot':
+            content = screenshot_content(msg.content, blob_store)
+            if content:
+                expand[i] = content
+
+    result = []
+    pending = []
+    for i, msg in enumerate(messages):
+        if pending and not isinstance(msg, ToolMessage):
+            result.append(HumanMessage(content=pending, id=f"{SCREENSHOT_MESSAGE_ID}{i}"))
+            pending = []
+        result.append(msg)
+        if i in expand:
+            pending.extend(expand[i])
+    if pending:
+        result.append(HumanMessage(content=pending, id=f"{SCREENSHOT_MESSAGE_ID}{len(messages)}"))
+    return result
@@ -0,0 +1,302 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from agents.context import count_tokens
+from collections import deque
+from typing import Any, Optional
+import threading
+import asyncio
+import random
+import time
+
+# errors worth retrying: rate limits, timeouts, dropped connections and server errors
+RETRYABLE_ERRORS = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError", "TimeoutError", "ConnectError", "ReadTimeout"}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    return type(error).__name__ in RETRYABLE_ERRORS or getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    '''Seconds the API asked us to wait, from the Retry-After header of the error's response'''
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+#Requests per minute and tokens per minute budgets, refilled continuously.
+#A call waits until both buckets have room for it
+class RateLimiter:
+    def __init__(self, rpm: float = 500, tpm: float = 200000):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._requests = rpm
+        self._tokens = tpm
+        self._updated = time.monotonic()
+        # set after a 429 so every caller backs off together instead of each finding out on its own
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+        self._updated = now
+
+    def _try_take(self, tokens: int) -> float:
+        '''Take the budget and return 0, or return how long to wait before trying again'''
+        # a prompt bigger than the whole bucket would otherwise wait forever
+        tokens = min(tokens, self.tpm)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            wait = max((1 - self._requests) * 60 / self.rpm, (tokens - self._tokens) * 60 / self.tpm, 0)
+            if wait == 0:
+                self._requests -= 1
+                self._tokens -= tokens
+            return wait
+
+    def acquire(self, tokens: int) -> float:
+        '''Blocking acquire, returns the seconds spent waiting'''
+        waited = 0.0
+        while (wait := self._try_take(tokens)) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def aacquire(self, tokens: int) -> float:
+        waited = 0.0
+        while (wait := self._try_take(tokens)) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def try_acquire(self, tokens: int) -> bool:
+        return self._try_take(tokens) == 0
+
+    def settle(self, estimated: int, actual: int):
+        '''Correct the token bucket once the real usage of a call is known'''
+        with self._lock:
+            self._tokens = min(self.tpm, self._tokens + estimated - actual)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+#Throttling, retries and hedging shared by every model wrapped with it, so all agents and
+#sessions in the process draw from one budget per API key
+class LLMGateway:
+    def __init__(self, rpm: float = 500, tpm: float = 200000, retries: int = 4, base_delay: float = 0.5,
+                 max_delay: float = 20, hedge_percentile: Optional[float] = None, hedge_min_samples: int = 20,
+                 expected_output_tokens: int = 300):
+        # hedge_percentile: when set, a call still running after this percentile of recent latencies
+        # (time to first token for streams) gets a second identical request, the first to answer wins
+        self.limiter = RateLimiter(rpm, tpm)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.expected_output_tokens = expected_output_tokens
+        self._lock = threading.Lock()
+        self._latencies = {"invoke": deque(maxlen=200), "stream": deque(maxlen=200)}
+        self.counters = {"requests": 0, "retries": 0, "rate_limited": 0, "hedges": 0, "hedge_wins": 0, "throttled_seconds": 0.0}
+
+    def wrap(self, model: BaseChatModel) -> "RateLimitedChatModel":
+        return RateLimitedChatModel(model=model, gateway=self)
+
+    def estimate_tokens(self, messages: list) -> int:
+        return sum(count_tokens(message) for message in messages) + self.expected_output_tokens
+
+    def count(self, counter: str, amount: float = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_latency(self, kind: str, seconds: float):
+        with self._lock:
+            self._latencies[kind].append(seconds)
+
+    def hedge_after(self, kind: str) -> Optional[float]:
+        '''Seconds after which a call of this kind should be hedged, None when hedging is off or there is too little data'''
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies[kind])
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))]
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        '''Full jitter exponential backoff, never shorter than what the API asked for'''
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(error)
+        if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+            self.count("rate_limited")
+            # everyone sharing the key slows down, not just this call
+            self.limiter.pause(requested or delay)
+        return max(delay, requested or 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            for kind, samples in self._latencies.items():
+                ordered = sorted(samples)
+                stats[f"{kind}_p50"] = round(ordered[len(ordered) // 2], 3) if ordered else None
+                stats[f"{kind}_p99"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 3) if ordered else None
+        return stats
+
+
+#Chat model wrapper that sends every call through an LLMGateway. It is a chat model itself,
+#so it works with bind_tools, create_agent and token streaming like the model it wraps
+class RateLimitedChatModel(BaseChatModel):
+    model: BaseChatModel
+    gateway: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate_limited_{self.model._llm_type}"
+
+    def bind_tools(self, tools, **kwargs):
+        # let the wrapped model format the tools, then pass the same arguments through on each call
+        return self.bind(**getattr(self.model.bind_tools(tools, **kwargs), "kwargs", {}))
+
+    # the wrapped model runs without callbacks, this wrapper reports tokens and runs to the caller's callbacks
+    def _call_config(self) -> dict:
+        return {"callbacks": []}
+
+    def _settle(self, estimated: int, message):
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            self.gateway.limiter.settle(estimated, usage["total_tokens"])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        estimated = self.gateway.estimate_tokens(messages)
+        for attempt in range(self.gateway.retries + 1):
+            self.gateway.count("throttled_seconds", self.gateway.limiter.acquire(estimated))
+            self.gateway.count("requests")
+            started = time.monotonic()
+            try:
+                message = self.model.invoke(messages, self._call_config(), stop=stop, **kwargs)
+            except Exception as e:
+                if attempt == self.gateway.retries or not is_retryable(e):
+                    raise
+                self.gateway.count("retries")
+                time.sleep(self.gateway.backoff(attempt, e))
+                continue
+            self.gateway.record_latency("invoke", time.monotonic() - started)
+            self._settle(estimated, message)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _ainvoke_once(self, messages, estimated: int, stop, kwargs):
+        self.gateway.count("requests")
+        message = await self.model.ainvoke(messages, self._call_config(), stop=stop, **kwargs)
+        self._settle(estimated, message)
+        return message
+
+    async def _race(self, kind: str, call, estimated: int, discard=None):
+        '''Await call(), sending a second identical call if the first is slower than the gateway's
+        hedge threshold for this kind. Returns the first successful result, discard(result) closes the loser'''
+        started = time.monotonic()
+        primary = asyncio.ensure_future(call())
+        hedge_after = self.gateway.hedge_after(kind)
+        tasks = [primary]
+        winner = None
+        try:
+            if hedge_after is not None:
+                done, _ = await asyncio.wait([primary], timeout=hedge_after)
+                # a hedge is only sent if the budget has room for it right now
+                if not done and self.gateway.limiter.try_acquire(estimated):
+                    self.gateway.count("hedges")
+                    tasks.append(asyncio.ensure_future(call()))
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not task.exception()), None)
+                if winner is not None:
+                    break
+            if winner is None:
+                raise next(iter(done)).exception()
+            if winner is not primary:
+                self.gateway.count("hedge_wins")
+            self.gateway.record_latency(kind, time.monotonic() - started)
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                task.cancel()
+                if discard and task.done() and not task.cancelled() and not task.exception():
+                    await discard(task.result())
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        estimated = self.gateway.estimate_tokens(messages)
+        for attempt in range(self.gateway.retries + 1):
+            self.gateway.count("throttled_seconds", await self.gateway.limiter.aacquire(estimated))
+            try:
+                message = await self._race("invoke", lambda: self._ainvoke_once(messages, estimated, stop, kwargs), estimated)
+            except Exception as e:
+                if attempt == self.gateway.retries or not is_retryable(e):
+                    raise
+                self.gateway.count("retries")
+                await asyncio.sleep(self.gateway.backoff(attempt, e))
+                continue
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimated = self.gateway.estimate_tokens(messages)
+        self.gateway.count("throttled_seconds", self.gateway.limiter.acquire(estimated))
+        self.gateway.count("requests")
+        for chunk in self.model.stream(messages, self._call_config(), stop=stop, **kwargs):
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _afirst_chunk(self, messages, estimated: int, stop, kwargs):
+        '''Start a stream and wait for its first chunk, returns (stream, first chunk or None)'''
+        self.gateway.count("requests")
+        stream = self.model.astream(messages, self._call_config(), stop=stop, **kwargs).__aiter__()
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+        except BaseException:
+            await stream.aclose()
+            raise
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimated = self.gateway.estimate_tokens(messages)
+        # retried until the first chunk arrives, after that the tokens are already on their way to the client
+        for attempt in range(self.gateway.retries + 1):
+            self.gateway.count("throttled_seconds", await self.gateway.limiter.aacquire(estimated))
+            try:
+                stream, first = await self._race(
+                    "stream", lambda: self._afirst_chunk(messages, estimated, stop, kwargs), estimated,
+                    discard=lambda started: started[0].aclose()
+                )
+                break
+            except Exception as e:
+                if attempt == self.gateway.retries or not is_retryable(e):
+                    raise
+                self.gateway.count("retries")
+                await asyncio.sleep(self.gateway.backoff(attempt, e))
+        if first is None:
+            return
+        usage = None
+        try:
+            chunk = first
+            while True:
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                yield ChatGenerationChunk(message=chunk if isinstance(chunk, AIMessageChunk) else AIMessageChunk(content=chunk.content))
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            await stream.aclose()
+        if usage:
+            self.gateway.limiter.settle(estimated, usage["total_tokens"])
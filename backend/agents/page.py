@@ -0,0 +1,122 @@
+from typing import Optional, Dict, List
+from agents.search import BM25Index, element_tokens
+import threading
+import re
+
+_header = re.compile(r"^@page url=<(.*)>$")
+_legend_entry = re.compile(r"(\.\d+)=<([^>]*)>")
+_element = re.compile(r"^(\s*)<(\d+)> (.*)$")
+_class_alias = re.compile(r" class=(\.\d+)(?= |$)")
+# an element line of a full listing or an added/changed line of a diff
+_listed_element = re.compile(r"^(?:[+~] )?\s*<(\d+)> ")
+
+
+class PageSnapshot:
+    def __init__(self, url: Optional[str], elements: Dict[str, str], body: str):
+        self.url = url
+        # uid -> element line without indentation, class aliases expanded
+        self.elements = elements
+        # the listing as sent by the client, minus the header
+        self.body = body
+        self._index: Optional[BM25Index] = None
+
+    @property
+    def index(self) -> BM25Index:
+        # built on first search, most snapshots are never searched
+        if self._index is None:
+            self._index = BM25Index({uid: element_tokens(line) for uid, line in self.elements.items()})
+        return self._index
+
+
+def parse_page(text: str) -> PageSnapshot:
+    '''Parse the compact process_page listing (optional @page header and class legend, one element per line)'''
+    lines = text.split("\n")
+    url = None
+    if lines and _header.match(lines[0]):
+        url = _header.match(lines[0]).group(1)
+        lines = lines[1:]
+
+    aliases = {}
+    if lines and lines[0].startswith("classes: "):
+        aliases = dict(_legend_entry.findall(lines[0]))
+
+    elements = {}
+    for line in lines:
+        match = _element.match(line)
+        if not match:
+            continue
+        rest = _class_alias.sub(lambda alias: f" class=<{aliases.get(alias.group(1), alias.group(1))}>", match.group(3))
+        elements[match.group(2)] = f"<{match.group(2)}> {rest}"
+    return PageSnapshot(url, elements, "\n".join(lines))
+
+
+def without_elements(listing: str, uids) -> str:
+    '''The listing (full or a diff) without the lines of the given elements'''
+    uids = set(uids)
+    kept = []
+    for line in listing.split("\n"):
+        match = _listed_element.match(line)
+        if not (match and match.group(1) in uids):
+            kept.append(line)
+    return "\n".join(kept)
+
+
+#Remembers the last process_page result per thread so a repeat call on the same page only returns what changed
+class PageSnapshots:
+    def __init__(self, max_changed_ratio: float = 0.5):
+        # when more than this share of elements changed a full listing is cheaper to read than the diff
+        self.max_changed_ratio = max_changed_ratio
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, PageSnapshot] = {}
+
+    def update(self, thread_id: str, text: str, full: bool = False) -> str:
+        '''Store the new snapshot and return what the model should see: the full listing or the changes'''
+        snapshot = parse_page(text)
+        if not snapshot.elements:
+            # not a page listing (error message, old client), pass it through untouched
+            return text
+        with self._lock:
+            previous = self._snapshots.get(thread_id)
+            self._snapshots[thread_id] = snapshot
+        if full or previous is None or previous.url != snapshot.url:
+            return snapshot.body
+        return self.diff(previous, snapshot)
+
+    def diff(self, previous: PageSnapshot, snapshot: PageSnapshot) -> str:
+        added = [line for uid, line in snapshot.elements.items() if uid not in previous.elements]
+        removed = [uid for uid in previous.elements if uid not in snapshot.elements]
+        changed = [
+            line for uid, line in snapshot.elements.items()
+            if uid in previous.elements and previous.elements[uid] != line
+        ]
+        if len(added) + len(removed) + len(changed) > self.max_changed_ratio * max(len(snapshot.elements), 1):
+            return snapshot.body
+        if not (added or removed or changed):
+            return f"Page unchanged since the last process_page ({len(snapshot.elements)} elements)."
+
+        unchanged = len(snapshot.elements) - len(added) - len(changed)
+        result = [f"Changes since the last process_page ({unchanged} unchanged elements omitted):"]
+        result += [f"+ {line}" for line in added]
+        result += [f"~ {line}" for line in changed]
+        result += [f"- {previous.elements[uid]}" for uid in removed]
+        return "\n".join(result)
+
+    def latest(self, thread_id: str) -> Optional[PageSnapshot]:
+        with self._lock:
+            return self._snapshots.get(thread_id)
+
+    def find(self, thread_id: str, query: str, k: int = 5) -> Optional[List[str]]:
+        '''Element lines of the last snapshot best matching query, None if the thread has no snapshot'''
+        with self._lock:
+            snapshot = self._snapshots.get(thread_id)
+        if snapshot is None:
+            return None
+        return [snapshot.elements[uid] for uid, _ in snapshot.index.search(query, k)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._snapshots)
+
+    def forget(self, thread_id: str):
+        with self._lock:
+            self._snapshots.pop(thread_id, None)
@@ -0,0 +1,111 @@
+from langgraph.prebuilt import ToolNode
+from langgraph.types import Command
+from langchain_core.messages import ToolMessage
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable
+import contextvars
+import threading
+import asyncio
+import time
+
+
+#ToolNode that runs all tool calls of a message at once and joins their results by tool_call_id.
+#Tools written as plain functions run on a dedicated thread pool, async ones (the browser tools
+#waiting on the extension) on the event loop. The whole step shares one deadline, step_timeout,
+#so a step takes as long as its slowest call instead of the sum of them. Only the async path
+#(ainvoke/astream, how the agent runs its graph) is overridden, a sync invoke runs like a plain ToolNode
+class ParallelToolNode(ToolNode):
+    def __init__(self, tools, step_timeout: Optional[float] = None, max_workers: int = 4,
+                 on_timeout: Optional[Callable[[dict], None]] = None, **kwargs):
+        # on_timeout(tool_call) is called for every call abandoned at the deadline
+        super().__init__(tools, **kwargs)
+        self.step_timeout = step_timeout
+        self.on_timeout = on_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tools")
+        self._lock = threading.Lock()
+        self.counters = {"steps": 0, "calls": 0, "timed_out": 0, "wall_seconds": 0.0, "tool_seconds": 0.0}
+
+    def _is_async(self, call) -> bool:
+        tool = self.tools_by_name.get(call["name"])
+        return tool is None or getattr(tool, "coroutine", None) is not None
+
+    def _timed_out(self, call) -> ToolMessage:
+        if self.on_timeout:
+            self.on_timeout(call)
+        return ToolMessage(
+            content=f"Tool {call['name']} did not finish within {self.step_timeout}s",
+            name=call["name"],
+            tool_call_id=call["id"],
+            status="error",
+        )
+
+    def _timed(self, run, *args):
+        started = time.monotonic()
+        try:
+            return run(*args)
+        finally:
+            self._count("tool_seconds", time.monotonic() - started)
+
+    async def _atimed(self, run, *args):
+        started = time.monotonic()
+        try:
+            return await run(*args)
+        finally:
+            self._count("tool_seconds", time.monotonic() - started)
+
+    def _count(self, counter: str, amount: float = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _combine(self, outputs: list, input_type: str):
+        # same output shapes as ToolNode
+        if not any(isinstance(output, Command) for output in outputs):
+            return outputs if input_type == "list" else {self.messages_key: outputs}
+        return [
+            output if isinstance(output, Command) else ([output] if input_type == "list" else {self.messages_key: [output]})
+            for output in outputs
+        ]
+
+    def _finish(self, started: float, calls: int):
+        self._count("steps")
+        self._count("calls", calls)
+        self._count("wall_seconds", time.monotonic() - started)
+
+    async def _afunc(self, input, config, *, store):
+        tool_calls, input_type = self._parse_input(input, store)
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for call in tool_calls:
+            if self._is_async(call):
+                tasks.append(asyncio.ensure_future(self._atimed(self._arun_one, call, input_type, config)))
+            else:
+                # copy the context so callbacks and config reach the tool in the worker thread
+                run = contextvars.copy_context().run
+                tasks.append(loop.run_in_executor(self.executor, run, self._timed, self._run_one, call, input_type, config))
+        outputs = []
+        try:
+            if tasks:
+                await asyncio.wait(tasks, timeout=self.step_timeout)
+            for call, task in zip(tool_calls, tasks):
+                if task.done():
+                    # re-raises interrupts and unhandled errors like ToolNode does
+                    outputs.append(task.result())
+                else:
+                    self._count("timed_out")
+                    outputs.append(self._timed_out(call))
+        finally:
+            # the calls still running are abandoned, also when the step is cancelled or a call raised
+            for task in tasks:
+                task.cancel()
+        self._finish(started, len(tool_calls))
+        return self._combine(outputs, input_type)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        # how much waiting running the calls side by side saved
+        stats["saved_seconds"] = round(max(stats["tool_seconds"] - stats["wall_seconds"], 0), 3)
+        stats["wall_seconds"] = round(stats["wall_seconds"], 3)
+        stats["tool_seconds"] = round(stats["tool_seconds"], 3)
+        return stats
@@ -0,0 +1,209 @@
+from agents.search import tokenize
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import List, Dict, Optional
+import threading
+import os
+import re
+
+_attribute = re.compile(r"([\w-]+)=<([^>]*)>")
+_tag = re.compile(r"^<(\d+)> <([\w-]+)>")
+_email = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_phone = re.compile(r"\+?\d[\d ().-]{7,}\d")
+_city_state = re.compile(r"^([A-Za-z .'-]+),\s*([A-Z]{2})$")
+_quoted = re.compile(r'"([^"]*)"')
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "do", "does", "for", "from", "have", "if", "in", "is", "it",
+    "of", "on", "or", "please", "the", "this", "to", "what", "will", "with", "you", "your", "input", "field",
+}
+
+# phrases a form may use for the facts pulled out of the resume
+RESUME_ALIASES = {
+    "full_name": ["full name", "name", "legal name"],
+    "first_name": ["first name", "given name", "fname", "first"],
+    "last_name": ["last name", "family name", "surname", "lname", "last"],
+    "email": ["email", "email address", "e mail"],
+    "phone": ["phone", "phone number", "mobile", "mobile number", "telephone", "cell"],
+    "location": ["location", "current location", "city state"],
+    "city": ["city"],
+    "state": ["state", "province"],
+    "school": ["school", "university", "college", "school name"],
+}
+
+# form fields that can hold a profile value
+FILLABLE_TAGS = {"input", "textarea", "select"}
+UNFILLABLE_TYPES = {"submit", "button", "checkbox", "radio", "file", "hidden", "password", "reset", "image"}
+
+
+def content_tokens(text: str) -> List[str]:
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+
+@lru_cache(maxsize=65536)
+def tokens_match(a: str, b: str) -> bool:
+    # forgiving enough for typos like sponsership/sponsorship and require/required, short words must be exact
+    return a == b or (min(len(a), len(b)) >= 5 and SequenceMatcher(None, a, b).ratio() >= 0.85)
+
+
+def similarity(field: List[str], alias: List[str]) -> float:
+    '''Dice coefficient over content tokens with fuzzy token equality'''
+    if not field or not alias:
+        return 0.0
+    remaining = list(alias)
+    overlap = 0
+    for token in field:
+        for candidate in remaining:
+            if tokens_match(token, candidate):
+                remaining.remove(candidate)
+                overlap += 1
+                break
+    return 2 * overlap / (len(field) + len(alias))
+
+
+class Fact:
+    def __init__(self, key: str, value: str, source: str, aliases: List[str]):
+        self.key = key
+        self.value = value
+        self.source = source
+        self.aliases = [content_tokens(alias) for alias in aliases]
+
+
+def parse_answers(text: str) -> List[Fact]:
+    '''"Question: answer" lines of the application answers file'''
+    facts = []
+    for line in text.split("\n"):
+        match = re.match(r"^\s*([^:;#][^:;]*?)\s*[:;]\s*(.+?)\s*$", line)
+        if not match:
+            continue
+        key, value = match.groups()
+        # 'You MUST type "+1"' means +1, '"I do not wish to answer"' loses its quotes
+        quoted = _quoted.findall(value)
+        if len(quoted) == 1:
+            value = quoted[0]
+        facts.append(Fact(key, value, "application answers", [key]))
+    return facts
+
+
+def parse_resume(text: str) -> List[Fact]:
+    '''Name, contact details and school from the markdown resume'''
+    values = {}
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    for i, line in enumerate(lines):
+        if line.startswith("## ") and "full_name" not in values:
+            values["full_name"] = line[3:].strip()
+            # contact details are on the line right under the name
+            for part in (lines[i + 1].split("|") if i + 1 < len(lines) else []):
+                part = part.strip()
+                if _email.search(part):
+                    values["email"] = _email.search(part).group(0)
+                elif _phone.fullmatch(part):
+                    values["phone"] = part
+                elif _city_state.match(part):
+                    values["location"] = part
+                    values["city"], values["state"] = _city_state.match(part).groups()
+        elif line.lower() == "## education" and i + 1 < len(lines) and lines[i + 1].startswith("## "):
+            values["school"] = lines[i + 1][3:].strip()
+
+    if "full_name" in values and len(values["full_name"].split()) >= 2:
+        values["first_name"] = values["full_name"].split()[0]
+        values["last_name"] = values["full_name"].split()[-1]
+    return [Fact(key, value, "resume", RESUME_ALIASES[key]) for key, value in values.items()]
+
+
+def form_fields(elements: Dict[str, str]) -> List[dict]:
+    '''Fillable, still empty fields of a page snapshot with the text describing them'''
+    fields = []
+    for line in elements.values():
+        tag = _tag.match(line)
+        if not tag or tag.group(2) not in FILLABLE_TAGS:
+            continue
+        attributes = dict(_attribute.findall(line))
+        if attributes.get("type") in UNFILLABLE_TYPES or attributes.get("value"):
+            continue
+        fields.append({"uid": tag.group(1), "tag": tag.group(2), "attributes": attributes})
+    return fields
+
+
+#Structured facts from the uploaded resume and application answers, rebuilt whenever the files change
+class ProfileIndex:
+    def __init__(self, resume_path: str = "uploads/res.md", answers_path: str = "uploads/app.md",
+                 threshold: float = 0.75, margin: float = 0.1, omit_threshold: float = 0.9):
+        # a field is matched when its best fact scores at least threshold and beats
+        # the best fact with a different value by margin
+        # matches scoring at least omit_threshold are sure enough to leave the field out of the page listing
+        self.omit_threshold = omit_threshold
+        self.resume_path = resume_path
+        self.answers_path = answers_path
+        self.threshold = threshold
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._signature = None
+        self._facts: List[Fact] = []
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.resume_path, self.answers_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _read(self, path: str) -> str:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+
+    def facts(self) -> List[Fact]:
+        signature = self._file_signature()
+        with self._lock:
+            if signature != self._signature:
+                self._facts = parse_resume(self._read(self.resume_path)) + parse_answers(self._read(self.answers_path))
+                self._signature = signature
+            return self._facts
+
+    def match_field(self, field: dict) -> Optional[dict]:
+        # label, name and id are scored separately, ids in particular carry a lot of noise
+        descriptions = [content_tokens(field["attributes"][key]) for key in ("label", "name", "id") if field["attributes"].get(key)]
+        scored = []
+        for fact in self.facts():
+            score = max((similarity(description, alias) for description in descriptions for alias in fact.aliases), default=0.0)
+            scored.append((score, fact))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        if not scored or scored[0][0] < self.threshold:
+            return None
+        best_score, best = scored[0]
+        runner_up = next((score for score, fact in scored[1:] if fact.value != best.value), 0.0)
+        if best_score - runner_up < self.margin:
+            return None
+        return {
+            "uid": field["uid"],
+            "action": "select" if field["tag"] == "select" else "input",
+            "value": best.value,
+            "field": field["attributes"].get("label") or field["attributes"].get("name") or field["attributes"].get("id"),
+            "fact": best.key,
+            "source": best.source,
+            "confidence": round(best_score, 2),
+        }
+
+    def propose(self, elements: Dict[str, str]) -> List[dict]:
+        '''Values for every empty form field that confidently matches a profile fact'''
+        proposals = []
+        for field in form_fields(elements):
+            proposal = self.match_field(field)
+            if proposal:
+                proposals.append(proposal)
+        return proposals
+
+
+def format_proposals(proposals: List[dict], omitted: int = 0) -> str:
+    # omitted: how many of the fields aren't in the listing above, they only appear here
+    lines = ["Fields matched to the user's profile (fill them with fill_form, no need to look them up):"]
+    if omitted:
+        lines[0] = f"Fields matched to the user's profile ({omitted} of them left out of the listing above, fill them with fill_form):"
+    lines += [f"<{p['uid']}> {p['field']} -> {p['value']} ({p['source']})" for p in proposals]
+    return "\n".join(lines)
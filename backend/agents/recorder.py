@@ -0,0 +1,199 @@
+from langchain_core.messages import message_to_dict
+from agents.cache import normalize_messages
+from agents.context import count_tokens
+from agents.blobs import BlobStore
+from agents.fake import ScriptedChatModel
+from collections import OrderedDict
+from typing import Optional, Callable, Dict, List
+import threading
+import hashlib
+import json
+import time
+import os
+import re
+
+
+def prompt_key(messages: list) -> str:
+    return hashlib.sha256(json.dumps(normalize_messages(messages), sort_keys=True, default=str).encode()).hexdigest()
+
+
+#Writes what happens in each thread to <directory>/<thread_id>.jsonl, one event per line:
+#  user        - a message, "Approve" or "Disapprove" from the client
+#  model       - a model call: prompt hash and size, the response, how long it took
+#  tool_result - a result the client sent for a browser tool call (page listings, screenshots, ...)
+#Prompts aren't stored, they can be rebuilt from the events before them. Tool results bigger than
+#inline_limit are kept once in <directory>/blobs and referenced by hash
+class SessionRecorder:
+    def __init__(self, directory: str, inline_limit: int = 16384, max_pending: int = 10000):
+        self.directory = directory
+        self.inline_limit = inline_limit
+        self.max_pending = max_pending
+        self.blobs = BlobStore(os.path.join(directory, "blobs"))
+        self._lock = threading.Lock()
+        # thread_id -> when its first event was recorded
+        self._started: Dict[str, float] = {}
+        # tool_call_id -> (thread_id, tool name, when the model asked for it), results can arrive before the tools run
+        self._calls: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def path(self, thread_id: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", str(thread_id)) + ".jsonl")
+
+    def _write(self, thread_id: str, event: dict):
+        now = time.monotonic()
+        with self._lock:
+            started = self._started.setdefault(thread_id, now)
+            line = json.dumps({"t": round(now - started, 4), **event}, default=str)
+            with open(self.path(thread_id), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def user(self, thread_id: str, data: str):
+        self._write(thread_id, {"event": "user", "data": data})
+
+    def model(self, thread_id: str, messages: list, response, seconds: float, cached: bool = False):
+        with self._lock:
+            for call in getattr(response, "tool_calls", None) or []:
+                self._calls[call["id"]] = (thread_id, call["name"], time.monotonic())
+            while len(self._calls) > self.max_pending:
+                self._calls.popitem(last=False)
+        self._write(thread_id, {
+            "event": "model",
+            "seconds": round(seconds, 4),
+            "cached": cached,
+            "messages": len(messages),
+            "prompt_tokens": sum(count_tokens(message) for message in messages),
+            "key": prompt_key(messages),
+            "response": message_to_dict(response),
+        })
+
+    def tool_result(self, tool_call_id: str, result: str):
+        '''Called with every result the client sends, results for calls no recorded thread made are ignored'''
+        with self._lock:
+            call = self._calls.pop(tool_call_id, None)
+        if call is None:
+            return
+        thread_id, name, asked = call
+        event = {"event": "tool_result", "tool_call_id": tool_call_id, "name": name, "seconds": round(time.monotonic() - asked, 4)}
+        if result is not None and len(result) > self.inline_limit:
+            event["blob"] = self.blobs.put(result.encode("utf-8"))
+        else:
+            event["result"] = result
+        self._write(thread_id, event)
+
+    def forget(self, thread_id: str):
+        with self._lock:
+            self._started.pop(thread_id, None)
+
+
+def load_recording(path: str) -> List[dict]:
+    '''Events of a recorded thread, with blob references resolved'''
+    blobs = BlobStore(os.path.join(os.path.dirname(path) or ".", "blobs"))
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if "blob" in event:
+                data = blobs.get(event.pop("blob"))
+                event["result"] = data.decode("utf-8") if data is not None else None
+            events.append(event)
+    return events
+
+
+#Plays a recorded thread back through an Agent without the browser or the model API: the model's
+#replies come from the recording (at the recorded speed or instantly) and browser tools get the
+#results the client sent at the time. Server side tools, context shaping and storage run for real
+class SessionReplay:
+    def __init__(self, events: List[dict], latency: str = "recorded"):
+        # latency: "recorded" waits as long as each model call took, "zero" doesn't wait
+        self.events = events
+        self.latency = latency
+        self.turns = []
+        self.prompts = []
+        # (tool names, content) of every recorded model reply, to check the replay against
+        self.expected = []
+        self.replayed = []
+        for event in events:
+            if event["event"] == "user" and event["data"] not in ("Approve", "Disapprove"):
+                self.turns.append([])
+                self.prompts.append(event["data"])
+            elif event["event"] == "model" and self.turns:
+                data = event["response"]["data"]
+                self.expected.append(([call["name"] for call in data.get("tool_calls", [])], data.get("content", "")))
+                step = {"tool_calls": [{"name": call["name"], "args": call["args"]} for call in data.get("tool_calls", [])],
+                        "content": data.get("content", "")}
+                if latency == "recorded":
+                    step["latency"] = event["seconds"]
+                self.turns[-1].append(step)
+        # browser tool results by tool name, in the order they were sent
+        self.results: Dict[str, List[Optional[str]]] = {}
+        for event in events:
+            if event["event"] == "tool_result":
+                self.results.setdefault(event["name"], []).append(event["result"])
+
+    def model(self) -> ScriptedChatModel:
+        return ScriptedChatModel(turns=self.turns, prompts=self.prompts, final_content="(end of recording)")
+
+    def divergence(self) -> Optional[str]:
+        '''Where the replayed model replies stop matching the recorded ones, None when the replay was faithful'''
+        for i, (expected, replayed) in enumerate(zip(self.expected, self.replayed)):
+            if expected != replayed:
+                return f"model call {i + 1}: recorded {expected}, replayed {replayed}"
+        if len(self.expected) != len(self.replayed):
+            return f"{len(self.expected)} model calls recorded, {len(self.replayed)} replayed"
+        return None
+
+    def _result(self, name: str) -> Optional[str]:
+        queue = self.results.get(name)
+        return queue.pop(0) if queue else None
+
+    async def run(self, agent, complete: Callable[[str, str], bool], thread_id: str = "replay",
+                  on_step: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        '''Replay every user event, complete(tool_call_id, result) delivers browser tool results like /completeTool.
+        Returns one entry per agent call with its duration, model calls and prompt tokens'''
+        config = {"configurable": {"thread_id": thread_id}}
+        decisions = [event["data"] for event in self.events if event["event"] == "user"]
+        steps = []
+
+        async def step(kind: str, call):
+            started = time.monotonic()
+            messages = await call
+            replies = [message for message in messages if message.type == "ai"]
+            self.replayed.extend(([call["name"] for call in message.tool_calls], message.content) for message in replies)
+            entry = {
+                "kind": kind,
+                "seconds": time.monotonic() - started,
+                "model_calls": len(replies),
+                "prompt_tokens": sum((message.usage_metadata or {}).get("input_tokens", 0) for message in replies),
+            }
+            steps.append(entry)
+            if on_step:
+                on_step(entry)
+
+        async def resolve(decision: Optional[str]):
+            snapshot = await agent.agent.aget_state(config)
+            if decision == "Disapprove":
+                await step("decline", agent.aresume_with_declined_tools({"config": config, "data": decision}))
+                return
+            for call in snapshot.values["messages"][-1].tool_calls:
+                result = self._result(call["name"])
+                if result is not None:
+                    complete(call["id"], result)
+            await step("approve", agent.aresume_with_approved_tools({"config": config, "data": "Approve"}))
+
+        index = 0
+        while index < len(decisions):
+            data = decisions[index]
+            index += 1
+            if data in ("Approve", "Disapprove"):
+                # nothing is waiting for it, e.g. the recording started mid conversation
+                continue
+            await step("message", agent.aget_response({"config": config, "data": data}))
+            while await agent.ahas_pending_tools(config):
+                # calls that ran unattended while recording are approved here without using up a decision
+                decision = None
+                if index < len(decisions) and decisions[index] in ("Approve", "Disapprove"):
+                    decision = decisions[index]
+                    index += 1
+                await resolve(decision)
+        return steps
@@ -0,0 +1,60 @@
+from typing import List, Dict, Tuple
+from collections import Counter
+import math
+import re
+
+_attribute = re.compile(r"([\w-]+)=<([^>]*)>")
+_tag = re.compile(r"^<\d+> <([\w-]+)>")
+_word = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+# how many times each field's tokens count, labels and visible text describe an element best
+FIELD_WEIGHTS = {"label": 3, "text": 2, "name": 2, "id": 2, "tag": 1, "role": 1, "type": 1, "class": 1}
+
+
+def tokenize(text: str) -> List[str]:
+    '''Lowercase words, splitting camelCase, snake_case and kebab-case identifiers'''
+    return [word.lower() for word in _word.findall(text)]
+
+
+def element_tokens(line: str) -> List[str]:
+    '''Weighted tokens of one process_page element line'''
+    tokens = []
+    tag = _tag.match(line)
+    if tag:
+        tokens += tokenize(tag.group(1)) * FIELD_WEIGHTS["tag"]
+    for key, value in _attribute.findall(line):
+        tokens += tokenize(value) * FIELD_WEIGHTS.get(key, 1)
+    return tokens
+
+
+#Inverted index with BM25 scoring over the elements of a page snapshot
+class BM25Index:
+    def __init__(self, documents: Dict[str, List[str]], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lengths = {doc_id: len(tokens) for doc_id, tokens in documents.items()}
+        self.average_length = sum(self.lengths.values()) / max(len(self.lengths), 1)
+        self.postings: Dict[str, Dict[str, int]] = {}
+        for doc_id, tokens in documents.items():
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, {})[doc_id] = frequency
+
+    def _terms(self, term: str) -> List[str]:
+        if term in self.postings:
+            return [term]
+        # no exact match, fall back to indexed words starting with it ("submit" -> "submission")
+        if len(term) >= 3:
+            return [indexed for indexed in self.postings if indexed.startswith(term)]
+        return []
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        scores: Dict[str, float] = {}
+        total = len(self.lengths)
+        for query_term in set(tokenize(query)):
+            for term in self._terms(query_term):
+                postings = self.postings[term]
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import Optional, Callable, Awaitable, List
+import threading
+import asyncio
+import time
+
+
+#Keeps the number of live conversation threads bounded: threads idle for longer than idle_ttl
+#and the least recently used ones beyond max_threads are evicted, and old checkpoints of
+#active threads are pruned so each keeps only its latest keep_checkpoints
+class SessionManager:
+    def __init__(self, idle_ttl: float = 3600, max_threads: int = 200, keep_checkpoints: int = 10,
+                 evict: Optional[Callable[[str], Awaitable]] = None,
+                 prune: Optional[Callable[[str, int], Awaitable[int]]] = None,
+                 busy: Optional[Callable[[str], bool]] = None):
+        # evict(thread_id): drops everything kept for a thread
+        # prune(thread_id, keep): drops older checkpoints, returns how many
+        # busy(thread_id): threads it returns True for are never evicted, e.g. with a connected client
+        self.idle_ttl = idle_ttl
+        self.max_threads = max_threads
+        # the latest checkpoint's parent is still read when resuming, always keep both
+        self.keep_checkpoints = max(keep_checkpoints, 2)
+        self.evict = evict
+        self.prune = prune
+        self.busy = busy or (lambda thread_id: False)
+        self._lock = threading.Lock()
+        # thread_id -> last use, least recently used first
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+        # threads used since the last sweep, their checkpoints may need pruning
+        self._dirty = set()
+        self.evicted = 0
+        self.pruned = 0
+
+    def touch(self, thread_id: str):
+        with self._lock:
+            self._last_used[thread_id] = time.monotonic()
+            self._last_used.move_to_end(thread_id)
+            self._dirty.add(thread_id)
+
+    def forget(self, thread_id: str):
+        with self._lock:
+            self._last_used.pop(thread_id, None)
+            self._dirty.discard(thread_id)
+
+    def _expired(self) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [thread_id for thread_id in self._last_used if not self.busy(thread_id)]
+            expired = [thread_id for thread_id in candidates if now - self._last_used[thread_id] > self.idle_ttl]
+            over = len(self._last_used) - len(expired) - self.max_threads
+            if over > 0:
+                # least recently used first
+                expired += [thread_id for thread_id in candidates if thread_id not in expired][:over]
+            for thread_id in expired:
+                self._last_used.pop(thread_id)
+                self._dirty.discard(thread_id)
+            return expired
+
+    async def sweep(self) -> dict:
+        '''Evict expired threads and prune the checkpoints of the ones used since the last sweep'''
+        expired = self._expired()
+        for thread_id in expired:
+            if self.evict:
+                await self.evict(thread_id)
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        pruned = 0
+        if self.prune:
+            for thread_id in dirty:
+                pruned += await self.prune(thread_id, self.keep_checkpoints)
+        self.evicted += len(expired)
+        self.pruned += pruned
+        return {"evicted": expired, "pruned_checkpoints": pruned}
+
+    async def run(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            oldest = min(self._last_used.values(), default=None)
+            return {
+                "threads": len(self._last_used),
+                "max_threads": self.max_threads,
+                "idle_ttl": self.idle_ttl,
+                "keep_checkpoints": self.keep_checkpoints,
+                "longest_idle_seconds": round(now - oldest, 1) if oldest is not None else None,
+                "evicted_total": self.evicted,
+                "pruned_checkpoints_total": self.pruned,
+            }
@@ -0,0 +1,134 @@
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.checkpoint.memory import MemorySaver
+from agents.blobs import blob_refs
+from typing import Dict, Set
+import aiosqlite
+import os
+
+
+#LangGraph checkpointer in a local SQLite file (WAL mode), so sessions survive restarts.
+#Rows are keyed (thread_id, checkpoint_ns, checkpoint_id)
+class SqliteCheckpointer(AsyncSqliteSaver):
+    async def setup(self) -> None:
+        first = not self.is_setup
+        await super().setup()
+        if first:
+            async with self.lock:
+                # writes lookup by thread, the primary key already covers checkpoints
+                await self.conn.execute("CREATE INDEX IF NOT EXISTS writes_thread ON writes (thread_id, checkpoint_ns, checkpoint_id)")
+                await self.conn.commit()
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.setup()
+        async with self.lock:
+            await self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    async def aprune_thread(self, thread_id: str, keep: int) -> int:
+        '''Delete all but the latest keep checkpoints of a thread (checkpoint ids sort by time)'''
+        await self.setup()
+        async with self.lock:
+            cursor = await self.conn.execute(
+                """DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id DESC LIMIT ?)""",
+                (str(thread_id), str(thread_id), keep)
+            )
+            await self.conn.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints WHERE thread_id = ?)",
+                (str(thread_id), str(thread_id))
+            )
+            await self.conn.commit()
+            return cursor.rowcount
+
+    async def athread_blob_refs(self) -> Dict[str, Set[str]]:
+        '''Blob keys each stored thread's checkpoints and pending writes refer to, every thread is included'''
+        await self.setup()
+        references = {}
+        async with self.lock:
+            for query in ("SELECT thread_id, checkpoint, metadata FROM checkpoints", "SELECT thread_id, value FROM writes"):
+                async with self.conn.execute(query) as cursor:
+                    async for thread_id, *values in cursor:
+                        keys = references.setdefault(thread_id, set())
+                        for value in values:
+                            keys.update(blob_refs(value))
+        return references
+
+    async def astats(self) -> dict:
+        await self.setup()
+        async with self.lock:
+            async with self.conn.execute("SELECT COUNT(*), COUNT(DISTINCT thread_id) FROM checkpoints") as cursor:
+                checkpoints, threads = await cursor.fetchone()
+            async with self.conn.execute("SELECT COUNT(*) FROM writes") as cursor:
+                (writes,) = await cursor.fetchone()
+        stats = {"backend": "sqlite", "threads": threads, "checkpoints": checkpoints, "writes": writes}
+        path = getattr(self, "path", None)
+        if path and os.path.exists(path):
+            stats["size_bytes"] = sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+        return stats
+
+
+#MemorySaver that can drop old checkpoints of a thread
+class PrunableMemorySaver(MemorySaver):
+    async def aprune_thread(self, thread_id: str, keep: int) -> int:
+        '''Delete all but the latest keep checkpoints of a thread, with their writes and channel values'''
+        pruned = 0
+        for checkpoint_ns, checkpoints in list(self.storage.get(thread_id, {}).items()):
+            ids = sorted(checkpoints, reverse=True)
+            removed = ids[keep:]
+            if not removed:
+                continue
+            for checkpoint_id in removed:
+                del checkpoints[checkpoint_id]
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            pruned += len(removed)
+            # channel values are stored once per version, keep the versions the remaining checkpoints use
+            used = set()
+            for checkpoint_id in ids[:keep]:
+                checkpoint = self.serde.loads_typed(checkpoints[checkpoint_id][0])
+                used.update(checkpoint["channel_versions"].items())
+            for key in [key for key in self.blobs if key[0] == thread_id and key[1] == checkpoint_ns]:
+                if (key[2], key[3]) not in used:
+                    del self.blobs[key]
+        return pruned
+
+    async def athread_blob_refs(self) -> Dict[str, Set[str]]:
+        '''Blob keys each stored thread's checkpoints, channel values and pending writes refer to'''
+        def typed_refs(value) -> Set[str]:
+            # everything is kept as (type, serialized bytes) somewhere inside tuples
+            if isinstance(value, (bytes, str)):
+                return blob_refs(value)
+            if isinstance(value, tuple):
+                return set().union(*(typed_refs(item) for item in value))
+            return set()
+
+        references = {thread_id: set() for thread_id in self.storage}
+        for thread_id, namespaces in self.storage.items():
+            for checkpoints in namespaces.values():
+                for saved in checkpoints.values():
+                    references[thread_id].update(typed_refs(saved))
+        for (thread_id, *_), value in self.blobs.items():
+            references.setdefault(thread_id, set()).update(typed_refs(value))
+        for (thread_id, *_), writes in self.writes.items():
+            for write in writes.values():
+                references.setdefault(thread_id, set()).update(typed_refs(write))
+        return references
+
+    async def astats(self) -> dict:
+        return {
+            "backend": "memory",
+            "threads": len(self.storage),
+            "checkpoints": sum(len(checkpoints) for namespaces in self.storage.values() for checkpoints in namespaces.values()),
+            "writes": len(self.writes),
+            "channel_values": len(self.blobs),
+        }
+
+
+async def open_checkpointer(path: str, timeout: float = 10) -> SqliteCheckpointer:
+    '''Must be called inside the running event loop the graph will use'''
+    # timeout is how long a write waits for another connection's transaction to finish
+    conn = await aiosqlite.connect(path, timeout=timeout)
+    checkpointer = SqliteCheckpointer(conn)
+    checkpointer.path = path
+    await checkpointer.setup()
+    return checkpointer
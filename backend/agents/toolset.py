@@ -0,0 +1,116 @@
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage
+from typing import Optional, Iterable, Set, Dict
+import inspect
+import re
+
+# id of the tool notes message, so it is only added to a thread once
+TOOL_NOTES_ID = "tool-notes"
+
+_SECTION = re.compile(r"^(Args|Arguments|Returns?|Examples?|Example response|Raises):\s*$")
+
+
+def split_docstring(doc: str):
+    '''Split a tool docstring into (summary, {arg: description}, details).
+    The summary is the first paragraph, details is everything but the summary and Args'''
+    lines = inspect.cleandoc(doc or "").splitlines()
+    end = next((i for i, line in enumerate(lines) if not line.strip() or _SECTION.match(line.strip())), len(lines))
+    summary = " ".join(line.strip() for line in lines[:end])
+    args, details, current, section = {}, [], None, None
+    for line in lines[end:]:
+        stripped = line.strip()
+        # a section header at the left margin ends the previous section
+        if _SECTION.match(stripped) and not line.startswith(" "):
+            section = stripped.rstrip(":")
+            current = None
+            if section not in ("Args", "Arguments"):
+                details.append(line)
+            continue
+        if section in ("Args", "Arguments") and stripped and not line.startswith(" "):
+            # text back at the left margin is past the argument list
+            section = None
+        if section in ("Args", "Arguments"):
+            match = re.match(r"^\s{1,8}(\w+)(?:\s*\([^)]*\))?:\s*(.*)$", line)
+            if match and (current is None or len(line) - len(line.lstrip()) <= 8):
+                current = match.group(1)
+                args[current] = match.group(2).strip()
+            elif stripped and current:
+                args[current] += " " + stripped
+            continue
+        # reST style return lines only repeat the summary
+        if stripped.startswith(":return"):
+            continue
+        details.append(line)
+    return summary, args, "\n".join(details).strip()
+
+
+def compact_schema(tool) -> dict:
+    '''OpenAI tool schema with only the first paragraph of the docstring as description
+    and the Args section as parameter descriptions'''
+    schema = convert_to_openai_tool(tool)
+    summary, args, _ = split_docstring(tool.description)
+    function = schema["function"]
+    function["description"] = summary or function.get("description", "")
+    for name, prop in function.get("parameters", {}).get("properties", {}).items():
+        if name in args and not prop.get("description"):
+            prop["description"] = args[name]
+    return schema
+
+
+def tool_notes(tools: Iterable) -> Optional[str]:
+    '''Return formats and examples left out of the compact schemas, sent once per thread'''
+    sections = []
+    for tool in tools:
+        _, _, details = split_docstring(tool.description)
+        if details:
+            sections.append(f"## {tool.name}\n{details}")
+    if not sections:
+        return None
+    return "Reference for the tools you can call, their results and examples:\n\n" + "\n\n".join(sections)
+
+
+def tool_notes_message(tools: Iterable) -> Optional[SystemMessage]:
+    notes = tool_notes(tools)
+    return SystemMessage(content=notes, id=TOOL_NOTES_ID) if notes else None
+
+
+# tool results that mean finding or using an element through the DOM didn't work
+# the client starts the result of a browser action that failed with this, the tool turns it into an error
+TOOL_FAILED_PREFIX = "[failed] "
+
+# tool -> words in the user's message that ask for it, the user asking for a screenshot is reason enough to offer it
+USER_REQUESTS = {"take_screenshot": ("screenshot", "screen shot")}
+
+
+#Picks the tools bound for a model call. Fallback tools (screenshots, coordinates, javascript) are
+#only offered once a DOM tool failed in the current turn or the user's message asks for them,
+#every other tool is always offered
+class ToolSelector:
+    def __init__(self, fallback_tools: Iterable[str] = ("take_screenshot", "click_with_coordinates", "execute_js"),
+                 dom_tools: Iterable[str] = ("process_page", "find_elements", "click", "input_tool", "fill_form"),
+                 user_requests: Optional[Dict[str, Iterable[str]]] = None):
+        self.fallback_tools = set(fallback_tools)
+        self.dom_tools = set(dom_tools)
+        self.user_requests = USER_REQUESTS if user_requests is None else user_requests
+
+    def failed(self, message: ToolMessage) -> bool:
+        # tools report failures themselves (ToolException), ToolNode and ParallelToolNode mark errors and timeouts the same way
+        return message.status == "error"
+
+    def requested(self, message) -> Set[str]:
+        '''Fallback tools the user's message asks for by name'''
+        text = str(message.content).lower()
+        return {name for name, words in self.user_requests.items() if any(word in text for word in words)}
+
+    def __call__(self, messages: list, names: Iterable[str]) -> Set[str]:
+        names = set(names)
+        # the current turn starts at the user's latest message
+        start = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=0)
+        dom_failed = any(
+            isinstance(message, ToolMessage) and message.name in self.dom_tools and self.failed(message)
+            for message in messages[start:]
+        )
+        if dom_failed:
+            return names
+        requested = self.requested(messages[start]) if messages and isinstance(messages[start], HumanMessage) else set()
+        return names - (self.fallback_tools - requested)
@@ -0,0 +1,274 @@
+"""
+Offline benchmark: drives concurrent sessions through /tool_agent, /approve and /decline with a scripted
+model and a simulated extension answering /completeTool from recorded page fixtures.
+No network or OpenAI key needed, the app runs in process.
+Run: python bench.py --sessions 50 --model-latency 0.8 --json bench.json
+"""
+from contextlib import redirect_stdout
+from agents.fake import ScriptedChatModel
+import argparse
+import asyncio
+import base64
+import random
+import json
+import time
+import sys
+import io
+import os
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is left out there
+    resource = None
+
+
+def percentile(samples: list, p: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def peak_rss() -> int:
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_script(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        script = json.load(f)
+    with open(os.path.join(os.path.dirname(path), script["page"]), "r", encoding="utf-8") as f:
+        script["page_text"] = f.read().rstrip("\n")
+    return script
+
+
+def pending_tool_calls(messages: list) -> list:
+    '''Tool calls of the last model reply that haven't got a result yet, what the side panel asks to approve'''
+    answered = {message.get("tool_call_id") for message in messages if message["type"] == "ToolMessage"}
+    replies = [message for message in messages if message["type"] == "AIMessage"]
+    if not replies:
+        return []
+    return [call for call in replies[-1].get("tool_calls") or [] if call["id"] not in answered]
+
+
+#Answers tool calls like the extension would, from a recorded page listing instead of a browser
+class FakeExtension:
+    def __init__(self, page: str, latency: float = 0.0):
+        self.page = page
+        self.latency = latency
+        self._screenshot = None
+
+    def screenshot(self) -> str:
+        if self._screenshot is None:
+            from PIL import Image, ImageDraw
+            image = Image.new("RGB", (1280, 720), "white")
+            draw = ImageDraw.Draw(image)
+            for row in range(8):
+                draw.rectangle([80, 60 + row * 80, 700, 100 + row * 80], outline="gray", width=2)
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            self._screenshot = json.dumps({
+                "screenshot": base64.b64encode(buffer.getvalue()).decode(),
+                "viewport": {"width": 1280, "height": 720}
+            })
+        return self._screenshot
+
+    def result(self, tool_call: dict) -> str:
+        name, args = tool_call["name"], tool_call.get("args", {})
+        if name == "process_page":
+            return self.page
+        if name == "take_screenshot":
+            return self.screenshot()
+        if name == "click":
+            return f"clicked {args.get('uid')}"
+        if name == "input_tool":
+            return f"Element successfully updated with input {args.get('content')}"
+        if name == "fill_form":
+            return json.dumps([
+                {"uid": operation.get("uid"), "success": True, "data": f"{operation.get('action', 'input')} {operation.get('value') or ''}"}
+                for operation in args.get("operations", [])
+            ])
+        if name == "click_with_coordinates":
+            return f"Clicked element at ({args.get('x')}, {args.get('y')})"
+        if name == "execute_js":
+            return json.dumps({"result": None, "stdout": "", "stderr": ""})
+        return "ok"
+
+
+#How late the event loop wakes a task up, a blocked loop delays every session at once
+class LoopLag:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.monotonic() - started - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+#Latencies per endpoint plus failures and overload rejections
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = {429: 0, 503: 0}
+        self.sessions = []
+
+    def record(self, kind: str, seconds: float):
+        self.latencies.setdefault(kind, []).append(seconds)
+
+    def error(self, kind: str, detail: str):
+        self.errors.setdefault(kind, []).append(detail)
+
+
+async def request(client, recorder: Recorder, kind: str, body: dict) -> list:
+    '''POST to the endpoint, waiting out 429/503 like the client would. Returns the messages of the reply'''
+    while True:
+        started = time.monotonic()
+        response = await client.post(f"/{kind}", json=body)
+        elapsed = time.monotonic() - started
+        if response.status_code in recorder.rejected:
+            recorder.rejected[response.status_code] += 1
+            await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+            continue
+        recorder.record(kind, elapsed)
+        if response.status_code != 200:
+            recorder.error(kind, f"{response.status_code} {response.text[:200]}")
+            return []
+        return response.json().get("messages", [])
+
+
+async def run_session(client, recorder: Recorder, session: int, script: dict, extension: FakeExtension,
+                      decline_rate: float, rng: random.Random, max_steps: int = 50):
+    thread_id = f"bench-{session}"
+    started = time.monotonic()
+    for turn in script["turns"]:
+        messages = await request(client, recorder, "tool_agent", {"data": turn["user"], "thread_id": thread_id, "clearHistory": False})
+        for _ in range(max_steps):
+            pending = pending_tool_calls(messages)
+            if not pending:
+                break
+            if rng.random() < decline_rate:
+                messages = await request(client, recorder, "decline", {"data": "Disapprove", "thread_id": thread_id, "clearHistory": False})
+                continue
+            # the side panel computes the results and sends them before approving
+            await asyncio.sleep(extension.latency)
+            await asyncio.gather(*(
+                request(client, recorder, "completeTool", {"tool_call_id": call["id"], "result": extension.result(call)})
+                for call in pending
+            ))
+            messages = await request(client, recorder, "approve", {"data": "Approve", "thread_id": thread_id, "clearHistory": False})
+    recorder.sessions.append(time.monotonic() - started)
+
+
+def report(recorder: Recorder, wall: float, lag: LoopLag, server: dict) -> dict:
+    ms = lambda seconds: round(seconds * 1000, 1) if seconds is not None else None
+    requests = sum(len(samples) for samples in recorder.latencies.values())
+    return {
+        "sessions": len(recorder.sessions),
+        "wall_seconds": round(wall, 2),
+        "requests": requests,
+        "requests_per_second": round(requests / wall, 1) if wall else None,
+        "steps_ms": {
+            kind: {"count": len(samples), "p50": ms(percentile(samples, 50)), "p95": ms(percentile(samples, 95)),
+                   "p99": ms(percentile(samples, 99)), "max": ms(max(samples))}
+            for kind, samples in recorder.latencies.items()
+        },
+        "session_ms": {"p50": ms(percentile(recorder.sessions, 50)), "p99": ms(percentile(recorder.sessions, 99))},
+        "rejected": recorder.rejected,
+        "errors": {kind: len(errors) for kind, errors in recorder.errors.items()},
+        "first_errors": [error for errors in recorder.errors.values() for error in errors][:5],
+        "peak_rss_mb": round(peak_rss() / 2**20, 1) if peak_rss() else None,
+        "loop_lag_ms": {"p50": ms(percentile(lag.samples, 50)), "p99": ms(percentile(lag.samples, 99)),
+                        "max": ms(max(lag.samples, default=0))},
+        "server": server,
+    }
+
+
+def print_report(result: dict):
+    print(f"{result['sessions']} sessions, {result['requests']} requests in {result['wall_seconds']}s "
+          f"({result['requests_per_second']} req/s), peak RSS {result['peak_rss_mb']} MB")
+    print(f"{'step':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, row in result["steps_ms"].items():
+        print(f"{kind:<14}{row['count']:>7}{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}{row['max']:>10}")
+    print(f"session p50 {result['session_ms']['p50']} ms, p99 {result['session_ms']['p99']} ms")
+    print(f"event loop lag p50 {result['loop_lag_ms']['p50']} ms, p99 {result['loop_lag_ms']['p99']} ms, max {result['loop_lag_ms']['max']} ms")
+    print(f"rejected {result['rejected']}, errors {result['errors']}")
+    for error in result["first_errors"]:
+        print(f"  {error}")
+
+
+async def benchmark(args) -> dict:
+    import httpx
+    import main as server
+
+    script = load_script(args.script)
+    server.tool_agent.use_llm(ScriptedChatModel(
+        turns=[turn["steps"] for turn in script["turns"]], prompts=[turn["user"] for turn in script["turns"]],
+        latency=args.model_latency, jitter=args.model_jitter
+    ))
+    extension = FakeExtension(script["page_text"], latency=args.client_latency)
+    recorder = Recorder()
+    lag = LoopLag()
+    rng = random.Random(args.seed)
+    # ASGI in process: no sockets, the server and the simulated clients share this event loop
+    transport = httpx.ASGITransport(app=server.app)
+    await server.app.router.startup()
+    limit = asyncio.Semaphore(args.concurrency or args.sessions)
+
+    async def limited(session: int):
+        async with limit:
+            await run_session(client, recorder, session, script, extension, args.decline_rate, rng)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            lag.start()
+            started = time.monotonic()
+            await asyncio.gather(*(limited(session) for session in range(args.sessions)))
+            wall = time.monotonic() - started
+            lag.stop()
+            stats = {"llm": (await client.get("/llm_stats")).json(), "memory": (await client.get("/memory")).json()}
+    finally:
+        await server.app.router.shutdown()
+    return report(recorder, wall, lag, stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="sessions to run")
+    parser.add_argument("--concurrency", type=int, default=0, help="sessions running at once, all of them by default")
+    parser.add_argument("--script", default="fixtures/bench_session.json", help="session script with the page fixture")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="seconds per model call")
+    parser.add_argument("--model-jitter", type=float, default=0.2, help="extra random seconds per model call")
+    parser.add_argument("--client-latency", type=float, default=0.05, help="seconds the extension takes per tool step")
+    parser.add_argument("--decline-rate", type=float, default=0.0, help="share of tool steps the user declines")
+    parser.add_argument("--session-db", default="", help="SQLite session store, in memory by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's own output")
+    args = parser.parse_args()
+
+    # read by main.py when it's imported: no real key is needed, and the gateway shouldn't throttle the fake model
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    os.environ["SESSION_DB"] = args.session_db
+    os.environ.setdefault("LLM_RPM", "1000000000")
+    os.environ.setdefault("LLM_TPM", "1000000000000")
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(sys.stdout if args.verbose else devnull):
+        result = asyncio.run(benchmark(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
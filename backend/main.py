@@ -1,15 +1,39 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
-from langchain_core.messages import HumanMessage,SystemMessage
+from typing import Optional, List, Dict, Annotated, Literal
+from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI
 import os
 from dotenv import load_dotenv
 from langchain.agents import create_agent
 from langchain.tools import tool
+from langchain_core.tools import InjectedToolCallId, ToolException
+from langchain_core.runnables import RunnableConfig
 from agents.agent import Agent
+from agents.broker import ToolResultBroker
+from agents.store import open_checkpointer, PrunableMemorySaver
+from agents.sessions import SessionManager
+from agents.admission import AdmissionControl, Overloaded
+from agents.llm import LLMGateway
+from agents.cache import ResponseCache
+from agents.toolset import ToolSelector, TOOL_FAILED_PREFIX
+from agents.approval import ApprovalPolicy, READ_ONLY, MUTATING, DANGEROUS
+from agents.parallel import ParallelToolNode
+from agents.recorder import SessionRecorder
+from agents.images import ScreenshotCompactor
+from agents.blobs import BlobStore
+from agents.context import ContextManager
+from agents.page import PageSnapshots, parse_page, without_elements
+from agents.profile import ProfileIndex, format_proposals
+from agents.files import FileToolCache
+from agents.documents import DocumentPipeline, CONVERTIBLE_EXTENSIONS
+import asyncio
 import base64
+import hashlib
+import json
+import sys
 from pathlib import Path
 
 
@@ -56,41 +80,70 @@ class ToolAgentResponse(BaseModel):
 class CompleteToolRequest(BaseModel):
     tool_call_id: str
     result: str
+
+# Prefill Request model
+class PrefillRequest(BaseModel):
+    thread_id: str = "1"
+    page: Optional[str] = None  # a fresh process_page listing, defaults to the thread's last one
 @tool
-def process_page() -> str:
+async def process_page(tool_call_id: Annotated[str, InjectedToolCallId], config: RunnableConfig, full: bool = False) -> str:
     """
     Process and extract interactive elements from the current page DOM.
 
     This includes buttons, inputs, links, forms, and combobox (dropdown) elements.
+    Calling it again on the same page only returns the elements that were added (+), changed (~) or removed (-)
+    since the previous call. UIDs stay the same for as long as an element is on the page.
+    To locate specific elements after the first listing, prefer find_elements over reading the page again.
+
+    Args:
+        full: return the whole listing even if the page was processed before. Use it if you no longer have the earlier listing.
 
     Returns:
-        str: A formatted string of DOM elements in the format:
-            <UID> <TAG> id=<ID> class=<CLASS> role=<ROLE> type=<TYPE> aria-expanded=<ARIA_EXPANDED> aria-haspopup=<ARIA_HASPOPUP> text=<TEXT>
+        str: A formatted string of DOM elements, one per line, in the format:
+            <UID> <TAG> id=<ID> class=<CLASS> name=<NAME> role=<ROLE> type=<TYPE> aria-expanded=<ARIA_EXPANDED> aria-haspopup=<ARIA_HASPOPUP> label=<LABEL> value=<VALUE> text=<TEXT>
             Where:
                 - UID: Unique numeric identifier for referencing the element (use this with the click tool)
                 - TAG: HTML element type (button, input, a, div, etc.)
-                - ID: The element's HTML id attribute (or "[UNAVAILABLE]" if none)
-                - CLASS: The element's HTML class attribute (or "[UNAVAILABLE]" if none)
-                - ROLE: The element's ARIA role attribute (or "[UNAVAILABLE]" if none). Includes combobox for dropdowns.
-                - TYPE: The element's type attribute, typically for input elements (or "[UNAVAILABLE]" if none)
-                - ARIA_EXPANDED: Whether the element is expanded (true/false), useful for combobox/dropdown elements (or "[UNAVAILABLE]" if not set)
-                - ARIA_HASPOPUP: Whether the element has a popup (true/false/menu/dialog, etc.), useful for combobox elements (or "[UNAVAILABLE]" if not set)
+                - ID, CLASS, NAME, ROLE, TYPE: the element's HTML attributes
+                - LABEL: the element's aria-label, <label> text or placeholder
+                - ARIA_EXPANDED: Whether the element is expanded (true/false), useful for combobox/dropdown elements
+                - ARIA_HASPOPUP: Whether the element has a popup (true/false/menu/dialog, etc.), useful for combobox elements
+                - VALUE: What is currently entered in an input, textarea or select (truncated to 50 chars)
                 - TEXT: Visible text content (truncated to 50 chars)
+            Attributes the element doesn't have are left out. Class strings used by several elements are
+            written as an alias like class=.0, defined on the first "classes:" line.
+            Empty fields that match the user's resume or application answers are listed at the end with the value to enter,
+            the surest matches only there and not with the other elements.
 
     Example:
-        <0> <body> id=<[UNAVAILABLE]> class=<[UNAVAILABLE]> role=<[UNAVAILABLE]> type=<[UNAVAILABLE]> aria-expanded=<[UNAVAILABLE]> aria-haspopup=<[UNAVAILABLE]> text=<Welcome to the page>
-          <1> <div> id=<main> class=<container> role=<[UNAVAILABLE]> type=<[UNAVAILABLE]> aria-expanded=<[UNAVAILABLE]> aria-haspopup=<[UNAVAILABLE]> text=<Welcome>
-            <2> <button> id=<btn> class=<btn-primary> role=<button> type=<[UNAVAILABLE]> aria-expanded=<[UNAVAILABLE]> aria-haspopup=<[UNAVAILABLE]> text=<Click me!>
-            <3> <div> id=<country-select> class=<combobox> role=<combobox> type=<[UNAVAILABLE]> aria-expanded=<false> aria-haspopup=<listbox> text=<Select a country>
+        classes: .0=<btn btn-primary>
+        <0> <body> text=<Welcome to the page>
+          <1> <div> id=<main> class=<container> text=<Welcome>
+            <2> <button> id=<btn> class=.0 role=<button> text=<Click me!>
+            <3> <div> id=<country-select> class=<combobox> role=<combobox> aria-expanded=<false> aria-haspopup=<listbox> text=<Select a country>
+            <4> <button> class=.0 text=<Cancel>
 
         To click the button, use click(uid="2")
         To open the combobox, use click(uid="3")
     """
-    result = wait_for_tool_result(timeout=30)
-    return result
+    result = await browser_result(tool_call_id, timeout=30)
+    thread_id = config["configurable"]["thread_id"]
+    listing = page_snapshots.update(thread_id, result, full=full)
+    snapshot = page_snapshots.latest(thread_id)
+    if snapshot is None:
+        return listing
+    # only propose values for fields the model can see in this result
+    proposals = await asyncio.to_thread(profile_index.propose, snapshot.elements)
+    proposals = [p for p in proposals if f"<{p['uid']}> " in listing]
+    if proposals:
+        # the proposal has everything needed to fill a sure match, its element line would only be read twice
+        omitted = [p["uid"] for p in proposals if p["confidence"] >= profile_index.omit_threshold]
+        listing = without_elements(listing, omitted)
+        listing += "\n\n" + format_proposals(proposals, omitted=len(omitted))
+    return listing
 
 @tool
-def click(uid: str) -> str:
+async def click(uid: str, tool_call_id: Annotated[str, InjectedToolCallId]) -> str:
     """Click an element on the page using its unique numeric identifier from process_page.
 
     Args:
@@ -104,10 +157,9 @@ def click(uid: str) -> str:
             <2> <button> <submit-btn> <Submit>
         Then call click(uid="2") to click that button.
     """
-    result = wait_for_tool_result(timeout=30)
-    return result
+    return await browser_result(tool_call_id, timeout=30)
 @tool
-def input_tool(uid:str,content:str)->str:
+async def input_tool(uid:str,content:str,tool_call_id: Annotated[str, InjectedToolCallId])->str:
     '''
     Tool used to fill an an input html element with data
 
@@ -117,10 +169,42 @@ def input_tool(uid:str,content:str)->str:
     Returns:
         str: result of inputting the string into the element
     '''
-    result = wait_for_tool_result(timeout=30)
-    return result
+    return await browser_result(tool_call_id, timeout=30)
+# One step of a fill_form batch
+class FormOperation(BaseModel):
+    uid: str  # UID of the element from process_page
+    action: Literal["input", "click", "select"] = "input"
+    value: Optional[str] = None  # text for input, option value or text for select
+
 @tool
-def click_with_coordinates(x:int,y:int) -> str:
+async def fill_form(operations: List[FormOperation], tool_call_id: Annotated[str, InjectedToolCallId]) -> str:
+    '''
+    Fill out several form fields in one step. Prefer this over many input_tool/click calls
+    whenever you know the values for more than one field.
+
+    Args:
+        operations: the operations to apply in order, each with
+            - uid: the UID of the element from process_page
+            - action: "input" to type value into an input or textarea, "click" to click the element,
+              "select" to choose the option of a <select> whose value or text is value
+            - value: the text to input or the option to select
+
+    Returns:
+        str: JSON list with one {"uid", "success", "data"} result per operation.
+        A failed operation doesn't stop the rest.
+
+    Example:
+        fill_form(operations=[
+            {"uid": "4", "action": "input", "value": "Jane"},
+            {"uid": "5", "action": "input", "value": "jane@example.com"},
+            {"uid": "9", "action": "select", "value": "United States"},
+            {"uid": "12", "action": "click"}
+        ])
+    '''
+    return await browser_result(tool_call_id, timeout=30)
+
+@tool
+async def click_with_coordinates(x:int,y:int,tool_call_id: Annotated[str, InjectedToolCallId]) -> str:
     '''Click an element on the page using x,y screen coordinates.
 
     Args:
@@ -130,27 +214,30 @@ def click_with_coordinates(x:int,y:int) -> str:
     Returns:
         str: Result of the click action.
     '''
-    result = wait_for_tool_result(timeout=30)
-    return result
+    return await browser_result(tool_call_id, timeout=30)
 
 @tool
-def take_screenshot() -> str:
+async def take_screenshot(tool_call_id: Annotated[str, InjectedToolCallId], config: RunnableConfig) -> str:
     '''
-    Takes a screenshot of the current page and returns it as a base64 encoded image along with viewport dimensions.
+    Takes a screenshot of the current page. The image is shown to you right after the tool result.
 
     Returns:
         str: A JSON string containing:
-            - screenshot: base64 encoded representation of the screenshot image
+            - screenshot_ref: reference to the stored screenshot image
             - viewport: object with width and height of the current viewport in pixels
+            If the page looks the same as in the previous screenshot, screenshot_ref is left out and
+            "unchanged" is true instead.
 
     Example response:
         {
-            "screenshot": "iVBORw0KGgoAAAANS...",
+            "screenshot_ref": "sha256:9f86d08...",
+            "mime_type": "image/jpeg",
             "viewport": {"width": 1280, "height": 720}
         }
     '''
-    result = wait_for_tool_result(timeout=30)
-    return result
+    result = await browser_result(tool_call_id, timeout=30)
+    # Decoding and re-encoding is CPU bound, keep it off the event loop
+    return await asyncio.to_thread(screenshot_compactor.compact, config["configurable"]["thread_id"], result)
 
 # @tool
 # def inspect(uid: str) -> str:
@@ -178,7 +265,7 @@ def take_screenshot() -> str:
 #     return result
 
 @tool
-def execute_js(code: str) -> str:
+async def execute_js(code: str, tool_call_id: Annotated[str, InjectedToolCallId]) -> str:
     """Execute arbitrary JavaScript code on the current page.
 
     Args:
@@ -198,83 +285,329 @@ def execute_js(code: str) -> str:
         execute_js(code="console.log('hello'); return 42")
         Returns: {"result": 42, "stdout": "hello", "stderr": ""}
     """
-    result = wait_for_tool_result(timeout=30)
-    return result if result else '{"error": "Timeout executing JavaScript"}'
+    return await browser_result(tool_call_id, timeout=30)
 
 @tool
-def add(x:int,y:int) -> str:
+async def add(x:int,y:int,tool_call_id: Annotated[str, InjectedToolCallId]) -> str:
     '''A tool that adds 2 numbers and returns their sum as a string result'''
     # Wait for client to compute and send result
-    result = wait_for_tool_result(timeout=30)
+    result = await wait_for_tool_result(tool_call_id, timeout=30)
     return result if result else f"Timeout: {x}+{y}"
 
 @tool
-def subtract(x:int, y:int) -> str:
+async def subtract(x:int, y:int, tool_call_id: Annotated[str, InjectedToolCallId]) -> str:
     '''A tool that subtracts 2 numbers and returns their diff as a string result'''
     # Wait for client to compute and send result
-    result = wait_for_tool_result(timeout=30)
+    result = await wait_for_tool_result(tool_call_id, timeout=30)
     return result if result else f"Timeout: {x}-{y}"
 
 @tool
-def get_users_resume() -> str:
+def get_users_resume(config: RunnableConfig, full: bool = False) -> str:
     '''
     Get the user's resume information.
+    Calling it again returns a short note instead of the same text when the resume hasn't changed.
+
+    Args:
+        full: return the whole resume even if it was returned before. Use it if you no longer have the earlier result.
 
     :return: textual resume information of the user
     '''
     try:
-        with open('uploads/res.md', "r", encoding='utf-8') as f:
-            return f.read()
+        return file_cache.result(config["configurable"]["thread_id"], "get_users_resume", 'uploads/res.md', full=full)
     except FileNotFoundError:
         return "Resume file not found at uploads/res.md"
     except Exception as e:
         return f"Error reading resume: {str(e)}"
 
 @tool
-def get_application_answers() -> str:
+def get_application_answers(config: RunnableConfig, full: bool = False) -> str:
     '''
     Get additional answers the users prepared for this specific application.
     Retrieves answers to application questions like location, visa requirements,
     programming language preferences, and other relevant information.
+    Calling it again returns a short note instead of the same text when the answers haven't changed.
+
+    Args:
+        full: return all answers even if they were returned before. Use it if you no longer have the earlier result.
 
     :return: application question answers from the user
     '''
     try:
-        with open('uploads/app.md', "r", encoding='utf-8') as f:
-            return f.read()
+        return file_cache.result(config["configurable"]["thread_id"], "get_application_answers", 'uploads/app.md', full=full)
     except FileNotFoundError:
         return "Application answers file not found at uploads/app.md"
     except Exception as e:
         return f"Error reading application answers: {str(e)}"
 
+@tool
+def find_elements(query: str, config: RunnableConfig, k: int = 5) -> str:
+    '''
+    Search the elements of the page from the last process_page call instead of reading the whole listing again.
+    Matches words in the element's label, text, name, id, class, role, type and tag.
+
+    Args:
+        query: words describing the element, e.g. "email input" or "submit button"
+        k: maximum number of elements to return
+
+    Returns:
+        str: the best matching element lines, in the same format as process_page, best match first
+
+    Example:
+        find_elements(query="email input") returns
+            <14> <input> id=<email> name=<email> type=<email> label=<Email address>
+    '''
+    elements = page_snapshots.find(config["configurable"]["thread_id"], query, k)
+    if elements is None:
+        raise ToolException("No page has been processed in this conversation yet, call process_page first")
+    if not elements:
+        raise ToolException(f"No elements match '{query}'")
+    return "\n".join(elements)
+
+# Every model call in the process shares one request/token budget, with jittered retries and
+# optional hedging (LLM_HEDGE_PERCENTILE=95 hedges calls slower than the p95 of recent ones)
+llm_gateway = LLMGateway(
+    rpm=float(os.getenv("LLM_RPM", 500)),
+    tpm=float(os.getenv("LLM_TPM", 200000)),
+    retries=int(os.getenv("LLM_RETRIES", 4)),
+    hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE")) if os.getenv("LLM_HEDGE_PERCENTILE") else None
+)
+
 # Initialize old agent for backward compatibility
-llm = ChatOpenAI(model="gpt-4o-mini")
+llm = llm_gateway.wrap(ChatOpenAI(model="gpt-4o-mini", max_retries=0))
 agent = create_agent(llm,tools=[add])
 
+# Tools computed on the server, everything else is run by the extension
+SERVER_TOOLS = {"get_users_resume", "get_application_answers", "find_elements"}
+
+# Open websocket per thread, used to push tool requests to the extension
+tool_channels: Dict[str, WebSocket] = {}
+
+# What each tool can do, calls to tools at an AUTO_APPROVE level run without asking the user
+TOOL_LEVELS = {
+    "process_page": READ_ONLY,
+    "find_elements": READ_ONLY,
+    "take_screenshot": READ_ONLY,
+    "get_users_resume": READ_ONLY,
+    "get_application_answers": READ_ONLY,
+    "click": MUTATING,
+    "input_tool": MUTATING,
+    "fill_form": MUTATING,
+    "click_with_coordinates": MUTATING,
+    "execute_js": DANGEROUS,
+}
+approval_policy = ApprovalPolicy(
+    TOOL_LEVELS,
+    auto_approve=[level.strip() for level in os.getenv("AUTO_APPROVE", READ_ONLY).split(",") if level.strip()],
+    # browser tools can only run unattended when the extension has its channel open to receive them
+    available=lambda thread_id, name: name in SERVER_TOOLS or thread_id in tool_channels
+)
+
+
+# Conversation state is kept in this SQLite file so sessions survive restarts,
+# set SESSION_DB= to keep everything in memory instead
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+
+# Broker for completed tool calls, keyed by tool_call_id. In memory: the server is one process and a
+# tool waiting on the client can't outlive it anyway
+tool_results = ToolResultBroker()
+
+# Last process_page listing per thread, repeat calls only return the changes
+page_snapshots = PageSnapshots()
+
+# Text of uploads/res.md and uploads/app.md for the tools, reread only when the files change
+file_cache = FileToolCache()
+
+# Facts parsed from uploads/res.md and uploads/app.md, matched to form fields without the model
+profile_index = ProfileIndex("uploads/res.md", "uploads/app.md", omit_threshold=float(os.getenv("PREFILL_OMIT_CONFIDENCE", 0.9)))
+
+# Converts uploaded documents (the resume PDF) to markdown in the background, cached by content hash
+document_pipeline = DocumentPipeline(os.getenv("CONVERTED_DIR", "converted"))
+
+# Screenshots are stored once here, messages and checkpoints only keep a reference
+blob_store = BlobStore(os.getenv("BLOB_DIR", "blobs"))
+
+# Downscales and re-encodes screenshots before they are stored and sent to the model
+screenshot_compactor = ScreenshotCompactor(
+    max_edge=int(os.getenv("SCREENSHOT_MAX_EDGE", 1280)),
+    format=os.getenv("SCREENSHOT_FORMAT", "JPEG"),
+    quality=int(os.getenv("SCREENSHOT_QUALITY", 75)),
+    blob_store=blob_store
+)
+
+async def wait_for_tool_result(tool_call_id: str, timeout: int = 30) -> Optional[str]:
+    """Wait for the result of a specific tool call to be sent by the client"""
+    return await tool_results.await_result(tool_call_id, timeout=timeout)
+
+async def browser_result(tool_call_id: str, timeout: int = 30) -> str:
+    """Wait for a browser tool's result, raising ToolException when the client reports the action failed or never answers"""
+    result = await wait_for_tool_result(tool_call_id, timeout=timeout)
+    if not result:
+        raise ToolException(f"No result from the browser within {timeout}s")
+    if result.startswith(TOOL_FAILED_PREFIX):
+        raise ToolException(result[len(TOOL_FAILED_PREFIX):])
+    return result
+
+async def dispatch_tool_calls(thread_id: str, tool_calls: list):
+    """Push browser tool calls to the thread's websocket, if one is open, as the tools node starts"""
+    websocket = tool_channels.get(thread_id)
+    if websocket is None:
+        return
+    try:
+        for tool_call in tool_calls:
+            if tool_call["name"] in SERVER_TOOLS:
+                continue
+            await websocket.send_json({
+                "type": "tool_request",
+                "tool_call": {
+                    "id": tool_call["id"],
+                    "name": tool_call["name"],
+                    "args": tool_call.get("args", {})
+                }
+            })
+    except (WebSocketDisconnect, RuntimeError):
+        # socket went away mid dispatch, the tools fall back to waiting on /completeTool
+        if tool_channels.get(thread_id) is websocket:
+            del tool_channels[thread_id]
+
+async def cancel_pending_tools(thread_id: str):
+    """Abandon the tool calls the thread is paused on so their waiters and early results are dropped"""
+    snapshot = await tool_agent.agent.aget_state({"configurable": {"thread_id": thread_id}})
+    if not snapshot.values.get("messages"):
+        return
+    for tool_call in getattr(snapshot.values["messages"][-1], "tool_calls", None) or []:
+        tool_results.cancel(tool_call["id"])
+
+# Keeps the prompt size flat as sessions grow, set CONTEXT_SUMMARIES=1 to fold old turns into a summary
+context_manager = ContextManager(
+    max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", 24000)),
+    recent_tokens=int(os.getenv("CONTEXT_RECENT_TOKENS", 8000)),
+    summary_llm=llm_gateway.wrap(ChatOpenAI(model="gpt-4o-mini", max_retries=0)) if os.getenv("CONTEXT_SUMMARIES") == "1" else None
+)
+
+SYSTEM_PROMPT = '''
+            you are a digital job application assistant
+
+            you are to help the user fill out a job application based on the inforation provided
+            You must first fill out all the fields with the information you have
+            -For the remaining fields you are unsure about, consult the user and help them complete them
+'''
+
+# Opt-in with LLM_CACHE=1: identical prompts (retried applications, replayed QA pages) are answered
+# from this cache instead of the model, LLM_CACHE_DB= keeps the entries across restarts
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", 512)),
+    ttl=float(os.getenv("LLM_CACHE_TTL", 24 * 3600)),
+    path=os.getenv("LLM_CACHE_DB") or None
+) if os.getenv("LLM_CACHE") == "1" else None
+
+# Tools are bound with one line descriptions, their formats and examples go into a note sent once per
+# thread (COMPACT_TOOLS=0 binds the full docstrings). Screenshot, coordinate and javascript tools are only
+# offered after a DOM tool failed in the current turn (DYNAMIC_TOOLS=0 always offers every tool)
+COMPACT_TOOLS = os.getenv("COMPACT_TOOLS", "1") == "1"
+tool_selector = ToolSelector() if os.getenv("DYNAMIC_TOOLS", "1") == "1" else None
+
+TOOLS = [process_page, find_elements, click, input_tool, fill_form, click_with_coordinates, get_users_resume, get_application_answers, take_screenshot, execute_js]
+# a tool raising ToolException has its message sent to the model as a result marked status="error"
+for agent_tool in TOOLS:
+    agent_tool.handle_tool_error = True
+
+# All calls of one model response run side by side, server tools on their own thread pool, and the step
+# gives up on whatever hasn't finished after TOOL_STEP_TIMEOUT seconds
+tool_node = ParallelToolNode(
+    TOOLS,
+    step_timeout=float(os.getenv("TOOL_STEP_TIMEOUT", 45)),
+    max_workers=int(os.getenv("SERVER_TOOL_WORKERS", 4)),
+    # late results for abandoned browser calls are dropped
+    on_timeout=lambda tool_call: tool_results.cancel(tool_call["id"])
+)
+
+# Opt-in with RECORD_DIR=recordings: every thread's messages, model calls and browser tool results are
+# written to <RECORD_DIR>/<thread_id>.jsonl, replay one with python test.py --replay <file>
+RECORD_DIR = os.getenv("RECORD_DIR")
+session_recorder = SessionRecorder(RECORD_DIR) if RECORD_DIR else None
+
 # Initialize new Agent class
-tool_agent = Agent([process_page, click, input_tool, click_with_coordinates, get_users_resume, get_application_answers, take_screenshot, execute_js])
-
-# Store conversation histories per thread
-conversation_histories: Dict[str, List] = {}
-
-# Queue for completed tool calls
-tool_results_queue: Dict[str, str] = {}  # {tool_call_id: result}
-import threading
-import time
-tool_queue_lock = threading.Lock()
-current_tool_call_id: Optional[str] = None
-
-def wait_for_tool_result(timeout: int = 30) -> Optional[str]:
-    """Wait for any tool result to appear in the queue"""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        with tool_queue_lock:
-            if tool_results_queue:
-                # Pop any available result
-                _, result = tool_results_queue.popitem()
-                return result
-        time.sleep(0.1)  # Poll every 100ms
-    return None
+tool_agent = Agent(TOOLS,
+                   on_tool_calls=dispatch_tool_calls,
+                   blob_store=blob_store,
+                   screenshots_in_prompt=int(os.getenv("SCREENSHOTS_IN_PROMPT", 1)),
+                   context_manager=context_manager,
+                   checkpointer=PrunableMemorySaver(),
+                   system_prompt=SYSTEM_PROMPT,
+                   gateway=llm_gateway,
+                   response_cache=response_cache,
+                   compact_tools=COMPACT_TOOLS,
+                   tool_selector=tool_selector,
+                   approval_policy=approval_policy,
+                   tool_node=tool_node,
+                   recorder=session_recorder)
+
+async def evict_thread(thread_id: str):
+    """Drop everything kept for a thread"""
+    await cancel_pending_tools(thread_id)
+    screenshot_compactor.forget(thread_id)
+    page_snapshots.forget(thread_id)
+    file_cache.forget(thread_id)
+    if session_recorder:
+        session_recorder.forget(thread_id)
+    await tool_agent.clear_history(thread_id)
+    # once the history referring to them is gone
+    blob_store.release(thread_id)
+
+async def prune_checkpoints(thread_id: str, keep: int) -> int:
+    return await tool_agent.agent.checkpointer.aprune_thread(thread_id, keep)
+
+# Evicts idle threads and old checkpoints so memory plateaus on a long running server
+session_manager = SessionManager(
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", 3600)),
+    max_threads=int(os.getenv("SESSION_MAX_THREADS", 200)),
+    keep_checkpoints=int(os.getenv("SESSION_KEEP_CHECKPOINTS", 10)),
+    evict=evict_thread,
+    prune=prune_checkpoints,
+    # never evict a thread while its extension is connected
+    busy=lambda thread_id: thread_id in tool_channels
+)
+background_tasks = set()
+
+# Same thread requests run one after another, and overall only this many agent runs are in flight
+admission = AdmissionControl(
+    max_in_flight=int(os.getenv("MAX_CONCURRENT_RUNS", 32)),
+    max_per_thread=int(os.getenv("MAX_QUEUED_PER_THREAD", 2)),
+    wait_timeout=float(os.getenv("ADMISSION_TIMEOUT", 1.0))
+)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.on_event("startup")
+async def open_session_store():
+    # the SQLite checkpointer is bound to the event loop, so it can only be opened once the server runs
+    app.state.checkpointer = await open_checkpointer(SESSION_DB) if SESSION_DB else None
+    if app.state.checkpointer:
+        tool_agent.use_checkpointer(app.state.checkpointer)
+    # blob owners are only kept in memory, read them back from the histories that survived the restart
+    # and age those threads out like any other
+    references = await tool_agent.agent.checkpointer.athread_blob_refs()
+    deleted = blob_store.rebuild(references)
+    for thread_id in references:
+        session_manager.touch(thread_id)
+    if deleted:
+        print(f"Deleted {deleted} screenshots no stored thread refers to")
+    sweeper = asyncio.create_task(session_manager.run(float(os.getenv("SESSION_SWEEP_INTERVAL", 60))))
+    background_tasks.add(sweeper)
+
+@app.on_event("shutdown")
+async def close_session_store():
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    # aiosqlite runs the connection on its own thread, the process can't exit while it is open
+    if getattr(app.state, "checkpointer", None):
+        await app.state.checkpointer.conn.close()
+        app.state.checkpointer = None
 
 
 def format_message_history(response) -> str:
@@ -319,6 +652,50 @@ async def root():
     return {"status": "ok", "message": "Agent API is running"}
 
 
+def resident_memory() -> Optional[int]:
+    """Current resident set size in bytes, peak RSS where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        # windows
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+@app.get("/memory")
+async def memory():
+    """What the server is holding on to, to check that memory plateaus"""
+    return {
+        "rss_bytes": resident_memory(),
+        "sessions": session_manager.stats(),
+        "checkpoints": await tool_agent.agent.checkpointer.astats(),
+        "caches": {
+            "page_snapshots": len(page_snapshots),
+            "screenshot_hashes": len(screenshot_compactor),
+            "context_summaries": len(context_manager),
+            "file_results": file_cache.stats(),
+            "pending_tool_results": tool_results.pending(),
+            "tool_channels": len(tool_channels),
+        },
+        "blobs": blob_store.stats(),
+        "admission": admission.stats(),
+    }
+
+@app.get("/llm_stats")
+async def llm_stats():
+    """Model call counters and latencies of the shared LLM gateway, response cache hits, tool approvals and tool steps"""
+    stats = llm_gateway.stats()
+    stats["response_cache"] = response_cache.stats() if response_cache else None
+    stats["approvals"] = approval_policy.stats()
+    stats["tools"] = tool_node.stats()
+    return stats
+
 @app.post("/agent", response_model=AgentResponse)
 async def agent_endpoint(request: AgentRequest):
     """
@@ -335,7 +712,7 @@ async def agent_endpoint(request: AgentRequest):
         # If no images, use simple text invocation
         if not request.images:
             message = HumanMessage(content=request.message)
-            response = agent.invoke({"messages": [message]})
+            response = await agent.ainvoke({"messages": [message]})
         else:
             # Construct multimodal message with text and images in a single content array
 
@@ -355,7 +732,7 @@ async def agent_endpoint(request: AgentRequest):
 
             # Create single HumanMessage with multimodal content (text + images)
             message = HumanMessage(content=content)
-            response = agent.invoke({"messages": [message]})
+            response = await agent.ainvoke({"messages": [message]})
 
         # Format the agent's message history into a readable response
         response_text = format_message_history(response)
@@ -365,62 +742,138 @@ async def agent_endpoint(request: AgentRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+# Largest file /upload_file/stream accepts
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+
+# What an upload is for and the markdown file the agent's tools read it from
+UPLOAD_TARGETS = {"resume": "res.md", "application": "app.md"}
+
+def upload_target(target: Optional[str]) -> Optional[str]:
+    if target is not None and target not in UPLOAD_TARGETS:
+        raise HTTPException(status_code=400, detail=f"target must be one of {', '.join(UPLOAD_TARGETS)}")
+    return target
+
+async def convert_upload(path: str, target: Optional[str] = None, digest: Optional[str] = None) -> dict:
+    if os.path.splitext(path)[1].lower() not in CONVERTIBLE_EXTENSIONS:
+        return {"status":"success"}
+    # the markdown replaces the resume or answers only when the client says the upload is one of them,
+    # otherwise it is only kept in the conversion cache
+    target = os.path.join(os.path.dirname(path), UPLOAD_TARGETS[target]) if target else None
+    job = await asyncio.to_thread(document_pipeline.submit, path, target, digest)
+    return {"status":"success", "job": job}
+
 @app.post("/upload_file")
 async def upload_file(request:dict):
+    target = upload_target(request.get('target'))
     file_data = base64.b64decode(request['fileData'])
-    file_name = request['fileName']
+    file_name = os.path.basename(request['fileName'])
 
     # Create uploads directory in current working directory
     upload_dir = "uploads"
     os.makedirs(upload_dir, exist_ok=True)
 
     # Write to disk
-    with open(os.path.join(upload_dir, file_name), "wb") as f:
+    path = os.path.join(upload_dir, file_name)
+    with open(path, "wb") as f:
         f.write(file_data)
-    return {"status":"success"}
+    return await convert_upload(path, target)
+
+@app.post("/upload_file/stream")
+async def upload_file_stream(request: Request, file_name: str, target: Optional[str] = None):
+    """Raw request body upload: the file is written to disk chunk by chunk as it arrives
+    and hashed on the way, instead of being base64 encoded into a JSON body"""
+    if not os.path.basename(file_name):
+        raise HTTPException(status_code=400, detail="file_name is required")
+    upload_target(target)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes")
+
+    upload_dir = "uploads"
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, os.path.basename(file_name))
+    # written under a temp name and renamed once complete, readers never see a partial file
+    tmp_path = f"{path}.{id(request)}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    result = await convert_upload(path, target, digest.hexdigest())
+    return {**result, "size": size, "sha256": digest.hexdigest()}
+
+@app.get("/upload_file/jobs/{job_id}")
+async def conversion_status(job_id: str):
+    """Status of a document conversion started by /upload_file: queued, running, done or failed"""
+    job = document_pipeline.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown conversion job")
+    return job
+
+@app.post("/prefill")
+async def prefill(request: PrefillRequest):
+    """Values for the empty fields of a page that match the user's profile,
+    as fill_form operations the extension can apply without a model call"""
+    # a listing sent here isn't stored, the model hasn't seen it so it can't be a diff base
+    snapshot = parse_page(request.page) if request.page else page_snapshots.latest(request.thread_id)
+    if snapshot is None:
+        return {"operations": [], "matches": []}
+    matches = await asyncio.to_thread(profile_index.propose, snapshot.elements)
+    operations = [{"uid": m["uid"], "action": m["action"], "value": m["value"]} for m in matches]
+    return {"operations": operations, "matches": matches}
 
 @app.post("/clear_history",response_model=ToolAgentResponse)
 async def clear_history(request:ToolAgentRequest):
-    print(f"Before clear: {len(conversation_histories.get(request.thread_id, []))} messages")
-
-    if not request.thread_id in conversation_histories:
-        return ToolAgentResponse(messages=[])
-    else:
-        conversation_histories[request.thread_id] = []
-        await tool_agent.clear_history(request.thread_id)
-        return ToolAgentResponse(messages=[])
+    await evict_thread(request.thread_id)
+    session_manager.forget(request.thread_id)
+    return ToolAgentResponse(messages=[])
+def thread_payload(thread_id: str, data: str) -> dict:
+    session_manager.touch(thread_id)
+    config = {
+        "configurable": {
+            "thread_id": thread_id
+        }
+    }
+    return {
+        "config": config,
+        "data": data
+    }
+
+async def run_approve(thread_id: str, data: str) -> list:
+    async with admission.admit(thread_id):
+        if not await tool_agent.ahas_pending_tools(thread_payload(thread_id, data)["config"]):
+            return []
+        return await tool_agent.aresume_with_approved_tools(thread_payload(thread_id, data))
+
+async def run_decline(thread_id: str, data: str) -> list:
+    async with admission.admit(thread_id):
+        if not await tool_agent.ahas_pending_tools(thread_payload(thread_id, data)["config"]):
+            return []
+        await cancel_pending_tools(thread_id)
+        return await tool_agent.aresume_with_declined_tools(thread_payload(thread_id, data))
+
+async def run_tool_agent(thread_id: str, data: str) -> list:
+    # the checkpoint holds the history, only the new message is sent
+    async with admission.admit(thread_id):
+        return await tool_agent.aget_response(thread_payload(thread_id, data))
+
 @app.post("/approve",response_model=ToolAgentResponse)
 async def approve(request:ToolAgentRequest):
-    if not request.thread_id in conversation_histories:
-        return ToolAgentResponse(messages=[])
-    else:
-        config = {
-            "configurable": {
-                "thread_id": request.thread_id
-            }
-        }        
-        payload = {
-            "config": config,
-            "data": request.data
-        }
-        res =  tool_agent.resume_with_approved_tools(payload)
-        return ToolAgentResponse(messages=get_message_dict(res))
+    res = await run_approve(request.thread_id, request.data)
+    return ToolAgentResponse(messages=get_message_dict(res))
 @app.post("/decline",response_model=ToolAgentResponse)
-async def approve(request:ToolAgentRequest):
-    if not request.thread_id in conversation_histories:
-        return ToolAgentResponse(messages=[])
-    else:
-        config = {
-            "configurable": {
-                "thread_id": request.thread_id
-            }
-        }        
-        payload = {
-            "config": config,
-            "data": request.data
-        }
-        res =  tool_agent.resume_with_declined_tools(payload)
-        return ToolAgentResponse(messages=get_message_dict(res))
+async def decline(request:ToolAgentRequest):
+    res = await run_decline(request.thread_id, request.data)
+    return ToolAgentResponse(messages=get_message_dict(res))
 @app.post("/tool_agent", response_model=ToolAgentResponse)
 async def tool_agent_endpoint(request: ToolAgentRequest):
     """
@@ -434,47 +887,81 @@ async def tool_agent_endpoint(request: ToolAgentRequest):
         ToolAgentResponse with list of messages
     """
     try:
-        # Get or initialize conversation history for this thread
-        if request.thread_id not in conversation_histories:
-
-            conversation_histories[request.thread_id] = [SystemMessage(content='''
-                you are a digital job application assistant
-
-                you are to help the user fill out a job application based on the inforation provided
-                You must first fill out all the fields with the information you have
-                -For the remaining fields you are unsure about, consult the user and help them complete them
-''')]
-
-
-
-        history = conversation_histories[request.thread_id]
-
-        # Create config with thread_id
-        config = {
-            "configurable": {
-                "thread_id": request.thread_id
-            }
-        }
-
-        # Create payload for agent
-        payload = {
-            "config": config,
-            "data": request.data
-        }
-
-        # Get response from agent
-        result = tool_agent.get_response(payload, history)
-
-        # Update conversation history
-        conversation_histories[request.thread_id] = history + result
+        result = await run_tool_agent(request.thread_id, request.data)
 
         # Convert messages to dictionaries for JSON response
-
         return ToolAgentResponse(messages=get_message_dict(result))
 
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_agent_events(start, thread_id: str):
+    """
+    Relay agent events as server sent events:
+        token   - an AIMessageChunk as the model generates it
+        message - a complete message added to the conversation
+        done    - all messages of the run, same as the non streaming endpoints return
+        error   - the run failed
+    Every payload uses the get_message_dict shape.
+    start() is awaited once the thread's turn has come and returns the agent events, or None
+    """
+    result = []
+    try:
+        async with admission.admit(thread_id):
+            events = await start()
+            if events is None:
+                events = []
+            async for kind, message in events:
+                if kind == "message":
+                    result.append(message)
+                yield sse_event(kind, get_message_dict([message])[0])
+        yield sse_event("done", {"messages": get_message_dict(result)})
+    except Overloaded as e:
+        yield sse_event("error", {"detail": e.detail, "status": e.status_code, "retry_after": e.retry_after})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Error processing request: {str(e)}"})
+
+
+@app.post("/tool_agent/stream")
+async def tool_agent_stream(request: ToolAgentRequest):
+    """Streaming version of /tool_agent"""
+    # fail fast with 429/503, the stream itself waits for the thread's turn
+    admission.check(request.thread_id)
+
+    async def start():
+        return tool_agent.astream_response(thread_payload(request.thread_id, request.data))
+    return StreamingResponse(stream_agent_events(start, request.thread_id), media_type="text/event-stream")
+
+@app.post("/approve/stream")
+async def approve_stream(request: ToolAgentRequest):
+    """Streaming version of /approve"""
+    admission.check(request.thread_id)
+    payload = thread_payload(request.thread_id, request.data)
+
+    async def start():
+        if not await tool_agent.ahas_pending_tools(payload["config"]):
+            return None
+        return tool_agent.astream_approved_tools(payload)
+    return StreamingResponse(stream_agent_events(start, request.thread_id), media_type="text/event-stream")
+
+@app.post("/decline/stream")
+async def decline_stream(request: ToolAgentRequest):
+    """Streaming version of /decline"""
+    admission.check(request.thread_id)
+    payload = thread_payload(request.thread_id, request.data)
+
+    async def start():
+        if not await tool_agent.ahas_pending_tools(payload["config"]):
+            return None
+        await cancel_pending_tools(request.thread_id)
+        return tool_agent.astream_declined_tools(payload)
+    return StreamingResponse(stream_agent_events(start, request.thread_id), media_type="text/event-stream")
+
 def get_message_dict(result:list):
     messages_dict = []
     for msg in  result:
@@ -514,17 +1001,73 @@ async def complete_tool(request: CompleteToolRequest):
         Success status
     """
     try:
-        with tool_queue_lock:
-            tool_results_queue[request.tool_call_id] = request.result
+        delivered = tool_results.complete(request.tool_call_id, request.result)
+        if session_recorder:
+            session_recorder.tool_result(request.tool_call_id, request.result)
 
         print(f"Tool result received: {request.tool_call_id} -> {request.result}")
+        if not delivered:
+            return {"status": "ignored", "message": "Tool call already completed or cancelled"}
         return {"status": "success", "message": "Tool result queued"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error queueing tool result: {str(e)}")
 
+@app.websocket("/ws/{thread_id}")
+async def tool_channel(websocket: WebSocket, thread_id: str):
+    """
+    Persistent channel for a thread. The server pushes tool requests as the graph reaches the tools node
+    and the client streams results back on the same connection.
+
+    Client -> server:
+        {"type": "message" | "approve" | "decline", "data": "..."}
+        {"type": "tool_result", "tool_call_id": "...", "result": "..."}
+    Server -> client:
+        {"type": "tool_request", "tool_call": {"id": ..., "name": ..., "args": ...}}
+        {"type": "messages", "request": <type of client message>, "messages": [...]}
+        {"type": "error", "detail": "..."}
+    """
+    await websocket.accept()
+    tool_channels[thread_id] = websocket
+    runners = {"message": run_tool_agent, "approve": run_approve, "decline": run_decline}
+
+    async def run(kind: str, data: str):
+        try:
+            result = await runners[kind](thread_id, data)
+            await websocket.send_json({"type": "messages", "request": kind, "messages": get_message_dict(result)})
+        except Overloaded as e:
+            await websocket.send_json({"type": "error", "status": e.status_code, "retry_after": e.retry_after, "detail": e.detail})
+        except Exception as e:
+            await websocket.send_json({"type": "error", "detail": f"Error processing request: {str(e)}"})
+
+    # agent runs happen in tasks so the loop keeps reading the tool results they wait on
+    tasks = set()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            kind = message.get("type")
+            if kind == "tool_result":
+                tool_results.complete(message["tool_call_id"], message["result"])
+                if session_recorder:
+                    session_recorder.tool_result(message["tool_call_id"], message["result"])
+            elif kind in runners:
+                task = asyncio.create_task(run(kind, message.get("data", "")))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if tool_channels.get(thread_id) is websocket:
+            del tool_channels[thread_id]
+        for task in tasks:
+            task.cancel()
+
 
 if __name__ == "__main__":
     import uvicorn
+    # one process only: tool channels, per-thread admission, sessions and the page/file caches live in memory,
+    # a request for a thread on another worker wouldn't reach its websocket or wait its turn
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
@@ -1,9 +1,15 @@
-from docling.document_converter import DocumentConverter
-# source = './uploads/SWEResume.pdf'
-
-# converter = DocumentConverter()
-# doc = converter.convert(source=source).document
-# res = doc.export_to_markdown()
-# with open("uploads/res.md","w") as f:
-#     f.write(res)
+from agents.documents import DocumentPipeline
+import sys
+import time
 
+# Convert a document by hand, e.g. python parser.py uploads/SWEResume.pdf uploads/res.md
+# /upload_file does the same for uploaded documents in the background
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else "./uploads/SWEResume.pdf"
+    target = sys.argv[2] if len(sys.argv) > 2 else "uploads/res.md"
+    pipeline = DocumentPipeline()
+    job = pipeline.submit(source, target)
+    while job["status"] in ("queued", "running"):
+        time.sleep(0.5)
+        job = pipeline.status(job["id"])
+    print(f"{source} -> {target}: {job['status']}{' (cached)' if job['cached'] else ''} {job['error'] or ''}")
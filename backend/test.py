@@ -1,6 +1,8 @@
 """
 Interactive CLI for testing the agent with tool approval using modern LangGraph
 Run: python test.py
+Replay a recorded thread (RECORD_DIR) through the server's agent, no browser or OpenAI key needed:
+     python test.py --replay recordings/<thread_id>.jsonl [--latency recorded|zero]
 """
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, MessagesState, START, END
@@ -9,6 +11,11 @@ from langgraph.checkpoint.memory import MemorySaver
 from langchain.tools import tool
 from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
 from dotenv import load_dotenv
+import argparse
+import asyncio
+import time
+import sys
+import os
 
 # Load environment variables
 load_dotenv()
@@ -19,40 +26,42 @@ def add(x: int, y: int) -> str:
     '''A tool that adds 2 numbers and returns their sum as a string result'''
     return str(x + y)
 
-# Initialize LLM with tools bound
-llm = ChatOpenAI(model="gpt-4o-mini")
-tools = [add]
-llm_with_tools = llm.bind_tools(tools)
+def build_agent():
+    """The agent graph with a gpt-4o-mini model, paused before tools for approval"""
+    # Initialize LLM with tools bound
+    llm = ChatOpenAI(model="gpt-4o-mini")
+    tools = [add]
+    llm_with_tools = llm.bind_tools(tools)
 
-# Define the agent function
-def call_model(state: MessagesState):
-    """Call the LLM with the current messages"""
-    response = llm_with_tools.invoke(state["messages"])
-    return {"messages": [response]}
+    # Define the agent function
+    def call_model(state: MessagesState):
+        """Call the LLM with the current messages"""
+        response = llm_with_tools.invoke(state["messages"])
+        return {"messages": [response]}
 
-# Define routing logic
-def should_continue(state: MessagesState):
-    """Determine if we should continue to tools or end"""
-    last_message = state["messages"][-1]
-    if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-        return "tools"
-    return END
+    # Define routing logic
+    def should_continue(state: MessagesState):
+        """Determine if we should continue to tools or end"""
+        last_message = state["messages"][-1]
+        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
+            return "tools"
+        return END
 
-# Build the graph
-workflow = StateGraph(MessagesState)
+    # Build the graph
+    workflow = StateGraph(MessagesState)
 
-# Add nodes
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", ToolNode(tools))
+    # Add nodes
+    workflow.add_node("agent", call_model)
+    workflow.add_node("tools", ToolNode(tools))
 
-# Add edges
-workflow.add_edge(START, "agent")
-workflow.add_conditional_edges("agent", should_continue, ["tools", END])
-workflow.add_edge("tools", "agent")
+    # Add edges
+    workflow.add_edge(START, "agent")
+    workflow.add_conditional_edges("agent", should_continue, ["tools", END])
+    workflow.add_edge("tools", "agent")
 
-# Compile with checkpointer and interrupt before tools
-memory = MemorySaver()
-agent = workflow.compile(checkpointer=memory, interrupt_before=["tools"])
+    # Compile with checkpointer and interrupt before tools
+    memory = MemorySaver()
+    return workflow.compile(checkpointer=memory, interrupt_before=["tools"])
 
 
 def format_message_history(response) -> str:
@@ -104,6 +113,8 @@ def main():
     print("=" * 60)
     print()
 
+    agent = build_agent()
+
     # Maintain conversation history and thread config
     conversation_history = []
     thread_config = {"configurable": {"thread_id": "1"}}
@@ -202,5 +213,52 @@ def main():
             print(f"\n❌ Error: {str(e)}\n")
 
 
+async def replay(path: str, latency: str) -> bool:
+    """Play a recorded thread back through the server's agent and print what each step took.
+    Returns whether the model replies matched the recording"""
+    from agents.recorder import SessionReplay, load_recording
+    # read by main.py when it's imported: nothing is sent to OpenAI, kept or recorded again
+    os.environ.setdefault("OPENAI_API_KEY", "offline-replay")
+    os.environ["SESSION_DB"] = ""
+    os.environ["RECORD_DIR"] = ""
+    os.environ["BLOB_DIR"] = ""
+    # summaries would need the real model
+    os.environ["CONTEXT_SUMMARIES"] = "0"
+    os.environ.setdefault("LLM_RPM", "1000000000")
+    os.environ.setdefault("LLM_TPM", "1000000000000")
+    import main as server
+
+    session = SessionReplay(load_recording(path), latency=latency)
+    server.tool_agent.use_llm(session.model())
+    rows = []
+
+    def on_step(step: dict):
+        rss = server.resident_memory()
+        rows.append(f"{len(rows) + 1:>4}  {step['kind']:<8}{step['seconds'] * 1000:>10.1f}{step['model_calls']:>7}"
+                    f"{step['prompt_tokens']:>10}{round(rss / 2**20, 1) if rss else '-':>10}")
+
+    await server.app.router.startup()
+    started = time.monotonic()
+    try:
+        steps = await session.run(server.tool_agent, server.tool_results.complete, on_step=on_step)
+    finally:
+        await server.app.router.shutdown()
+    print(f"Replayed {path} at {latency} latency: {len(steps)} steps in {time.monotonic() - started:.2f}s, "
+          f"{sum(step['model_calls'] for step in steps)} model calls, {sum(step['prompt_tokens'] for step in steps)} prompt tokens")
+    print(f"{'step':>4}  {'kind':<8}{'ms':>10}{'calls':>7}{'tokens':>10}{'rss MB':>10}")
+    print("\n".join(rows))
+    divergence = session.divergence()
+    if divergence:
+        print(f"Replay diverged from the recording at {divergence}")
+    return divergence is None
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replay", help="recorded thread to play back instead of the interactive CLI")
+    parser.add_argument("--latency", choices=["recorded", "zero"], default="recorded", help="model latency during replay")
+    args = parser.parse_args()
+    if args.replay:
+        sys.exit(0 if asyncio.run(replay(args.replay, args.latency)) else 1)
+    else:
+        main()
@@ -0,0 +1,78 @@
+'''Run from backend/: python -m unittest discover tests'''
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.graph import StateGraph, MessagesState, START, END
+from agents.blobs import BlobStore
+from agents.store import open_checkpointer, PrunableMemorySaver
+import tempfile
+import unittest
+import asyncio
+import json
+import os
+
+
+def build_graph(checkpointer):
+    graph = StateGraph(MessagesState)
+    graph.add_node("reply", lambda state: {"messages": [AIMessage(content="ok")]})
+    graph.add_edge(START, "reply")
+    graph.add_edge("reply", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+async def store_screenshot(graph, thread_id: str, key: str):
+    # the same shape a compacted screenshot result has in a thread's history
+    content = json.dumps({"screenshot_ref": key, "viewport": {"width": 1280, "height": 720}})
+    await graph.ainvoke({"messages": [HumanMessage(content=content)]}, {"configurable": {"thread_id": thread_id}})
+
+
+class RebuildTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.blob_dir = os.path.join(self.directory.name, "blobs")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_owners_survive_a_restart(self):
+        async def run():
+            checkpointer = await open_checkpointer(os.path.join(self.directory.name, "sessions.db"))
+            try:
+                graph = build_graph(checkpointer)
+                blobs = BlobStore(self.blob_dir)
+                shared = blobs.put(b"shared", owner="a")
+                only_b = blobs.put(b"only b", owner="b")
+                # the thread that stored it was dropped while the server was down
+                orphan = blobs.put(b"orphan", owner="gone")
+                await store_screenshot(graph, "a", shared)
+                await store_screenshot(graph, "b", shared)
+                await store_screenshot(graph, "b", only_b)
+
+                # a new process only has what is on disk
+                restarted = BlobStore(self.blob_dir)
+                references = await checkpointer.athread_blob_refs()
+                self.assertEqual(references, {"a": {shared}, "b": {shared, only_b}})
+                self.assertEqual(restarted.rebuild(references), 1)
+                self.assertIsNone(restarted.get(orphan))
+
+                # b's history still refers to the shared screenshot
+                restarted.release("a")
+                self.assertEqual(restarted.get(shared), b"shared")
+                restarted.release("b")
+                self.assertIsNone(restarted.get(shared))
+                self.assertIsNone(restarted.get(only_b))
+            finally:
+                await checkpointer.conn.close()
+        asyncio.run(run())
+
+    def test_memory_saver_references(self):
+        async def run():
+            checkpointer = PrunableMemorySaver()
+            graph = build_graph(checkpointer)
+            key = BlobStore().put(b"image", owner="a")
+            await store_screenshot(graph, "a", key)
+            await graph.ainvoke({"messages": [HumanMessage(content="hi")]}, {"configurable": {"thread_id": "b"}})
+            self.assertEqual(await checkpointer.athread_blob_refs(), {"a": {key}, "b": set()})
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
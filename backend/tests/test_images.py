@@ -0,0 +1,50 @@
+"""
+Run from backend/: python -m unittest discover tests
+"""
+from PIL import Image, ImageDraw
+from agents.images import ScreenshotCompactor
+import unittest
+import base64
+import json
+import io
+
+
+def screenshot(typed: str = "") -> str:
+    '''A form with one text field, as the extension would send it'''
+    image = Image.new("RGB", (1280, 720), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((80, 40), "First name", fill="black")
+    draw.rectangle([80, 60, 500, 92], outline="gray", width=2)
+    if typed:
+        draw.text((88, 70), typed, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return json.dumps({"screenshot": base64.b64encode(buffer.getvalue()).decode(), "viewport": {"width": 1280, "height": 720}})
+
+
+class ScreenshotCompactorTest(unittest.TestCase):
+    def test_typing_into_a_field_counts_as_changed(self):
+        # a single character or a short name barely moves a perceptual hash
+        for typed in ("J", "Jane", "Jane Doe", "jane.doe@example.com"):
+            with self.subTest(typed=typed):
+                compactor = ScreenshotCompactor()
+                compactor.compact("thread", screenshot())
+                result = json.loads(compactor.compact("thread", screenshot(typed)))
+                self.assertFalse(result.get("unchanged"))
+                self.assertIn("screenshot", result)
+
+    def test_same_screenshot_is_unchanged(self):
+        compactor = ScreenshotCompactor()
+        compactor.compact("thread", screenshot("Jane"))
+        result = json.loads(compactor.compact("thread", screenshot("Jane")))
+        self.assertTrue(result.get("unchanged"))
+
+    def test_threads_are_compared_separately(self):
+        compactor = ScreenshotCompactor()
+        compactor.compact("one", screenshot())
+        result = json.loads(compactor.compact("two", screenshot()))
+        self.assertFalse(result.get("unchanged"))
+
+
+if __name__ == "__main__":
+    unittest.main()
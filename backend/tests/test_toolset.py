@@ -0,0 +1,43 @@
+'''Run from backend/: python -m unittest discover tests'''
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from agents.toolset import ToolSelector
+import unittest
+
+NAMES = ["process_page", "find_elements", "click", "input_tool", "fill_form",
+         "take_screenshot", "click_with_coordinates", "execute_js", "get_users_resume"]
+FALLBACK = {"take_screenshot", "click_with_coordinates", "execute_js"}
+
+
+def turn(request: str, name: str, content: str, status: str = "success") -> list:
+    return [
+        HumanMessage(content=request),
+        AIMessage(content="", tool_calls=[{"name": name, "args": {}, "id": "call_1"}]),
+        ToolMessage(content=content, name=name, tool_call_id="call_1", status=status),
+    ]
+
+
+class ToolSelectorTest(unittest.TestCase):
+    def setUp(self):
+        self.select = ToolSelector()
+
+    def test_page_text_that_reads_like_an_error_is_not_a_failure(self):
+        listing = "<0> <body>\n  <1> <a> text=<Page not found? Contact us>\n  <2> <input> label=<Can't find your city?>"
+        offered = self.select(turn("fill this form", "process_page", listing), NAMES)
+        self.assertEqual(offered, set(NAMES) - FALLBACK)
+
+    def test_failed_dom_tool_offers_fallback_tools(self):
+        offered = self.select(turn("submit it", "click", "Element 15 not found in domMap", status="error"), NAMES)
+        self.assertEqual(offered, set(NAMES))
+
+    def test_failure_in_an_earlier_turn_is_forgotten(self):
+        messages = turn("submit it", "click", "Element 15 not found in domMap", status="error")
+        messages += [AIMessage(content="done"), HumanMessage(content="now the next page")]
+        self.assertEqual(self.select(messages, NAMES), set(NAMES) - FALLBACK)
+
+    def test_user_can_ask_for_a_screenshot(self):
+        offered = self.select([HumanMessage(content="Take a screenshot and tell me what you see")], NAMES)
+        self.assertEqual(offered, set(NAMES) - {"click_with_coordinates", "execute_js"})
+
+
+if __name__ == "__main__":
+    unittest.main()
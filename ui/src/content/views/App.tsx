@@ -23,46 +23,108 @@ function isInteractive(element: Element): boolean {
   return false;
 }
 
+// The page listing has one element per line, so labels and values spanning several lines are joined into one
+function oneLine(value: string): string {
+  return value.replace(/\s+/g, ' ').trim()
+}
+
+// What a user would read as the element's name: aria-label, an associated <label> or the placeholder
+function elementLabel(element: Element): string | null {
+  const label = element.getAttribute('aria-label')
+    || (element as HTMLInputElement).labels?.[0]?.innerText
+    || element.getAttribute('placeholder')
+  return label ? oneLine(label).substring(0, 50) || null : null
+}
+
+// What is currently entered in a form field, so filled fields can be told apart from empty ones
+function elementValue(element: Element): string | null {
+  if (!(element instanceof HTMLInputElement || element instanceof HTMLTextAreaElement || element instanceof HTMLSelectElement)) {
+    return null
+  }
+  if (element instanceof HTMLInputElement && ['password', 'hidden', 'submit', 'button', 'reset'].includes(element.type)) {
+    return null
+  }
+  if (element instanceof HTMLInputElement && ['checkbox', 'radio'].includes(element.type)) {
+    return element.checked ? 'checked' : null
+  }
+  return oneLine(element.value.replace(/[<>]/g, ' ')).substring(0, 50) || null
+}
+
+// Attributes reported for each interactive element, left out of a line when the element doesn't have them
+function elementAttributes(element: Element): Array<[string, string]> {
+  const attributes: Array<[string, string | null]> = [
+    ['id', element.id || null],
+    ['class', typeof element.className === 'string' ? element.className.trim() || null : null],
+    ['name', element.getAttribute('name')],
+    ['role', element.getAttribute('role')],
+    ['type', (element as HTMLInputElement).type || null],
+    ['aria-expanded', element.getAttribute('aria-expanded')],
+    ['aria-haspopup', element.getAttribute('aria-haspopup')],
+    ['label', elementLabel(element)],
+    ['value', elementValue(element)],
+  ]
+  return attributes
+    .map(([key, value]): [string, string | null] => [key, value ? oneLine(value) || null : null])
+    .filter((attribute): attribute is [string, string] => !!attribute[1])
+}
+
 function processPage(
   element: Element,
   depth: number = 0,
   counter: { value: number } = { value: 0 },
-  domMap: Record<number, Element> = {}
+  domMap: Record<number, Element> = {},
+  uids: WeakMap<Element, number> = new WeakMap()
 ): { str: string; domMap: Record<number, Element> } {
       if (element.nodeType !== Node.ELEMENT_NODE ) {
         return { str: "", domMap };
       }
 
       let str = "";
-      let uid = -1;
 
       // Only add to domMap and output if element is interactive
       if (isInteractive(element)) {
-        uid = counter.value++;
+        // an element keeps its uid across calls so the server can diff snapshots by uid
+        let uid = uids.get(element)
+        if (uid === undefined) {
+          uid = counter.value++;
+          uids.set(element, uid)
+        }
         domMap[uid] = element;
 
         const tag = element.tagName.toLowerCase();
-        const id = element.id || "[UNAVAILABLE]";
-        const className = element.className || "[UNAVAILABLE]";
-        const role = element.getAttribute('role') || "[UNAVAILABLE]";
-        const type = (element as HTMLInputElement).type || "[UNAVAILABLE]";
-        const ariaExpanded = element.getAttribute('aria-expanded') || "[UNAVAILABLE]";
-        const ariaHasPopup = element.getAttribute('aria-haspopup') || "[UNAVAILABLE]";
-        const text = (element as HTMLElement).innerText?.trim().substring(0, 50) || "";
+        const attributes = elementAttributes(element).map(([key, value]) => `${key}=<${value}>`).join(' ');
+        const text = oneLine((element as HTMLElement).innerText || "").substring(0, 50);
         const indent = "  ".repeat(depth);
 
-        str = `${indent}<${uid}> <${tag}> id=<${id}> class=<${className}> role=<${role}> type=<${type}> aria-expanded=<${ariaExpanded}> aria-haspopup=<${ariaHasPopup}> text=<${text}>\n`;
+        str = `${indent}<${uid}> <${tag}>${attributes ? ' ' + attributes : ''}${text ? ` text=<${text}>` : ''}\n`;
       }
 
       // Always traverse children to find nested interactive elements
       for (const child of Array.from(element.children)) {
-          const result = processPage(child, depth + 1, counter, domMap);
+          const result = processPage(child, depth + 1, counter, domMap, uids);
           str += result.str;
       }
 
       return { str, domMap };
 }
 
+// Replace class strings used more than once with a short alias defined in a legend on the first line
+function aliasClasses(str: string): string {
+  const counts = new Map<string, number>()
+  for (const match of str.matchAll(/ class=<([^>]*)>/g)) {
+    counts.set(match[1], (counts.get(match[1]) ?? 0) + 1)
+  }
+  const aliases = new Map<string, string>()
+  for (const [className, count] of counts) {
+    if (count > 1) aliases.set(className, `.${aliases.size}`)
+  }
+  if (aliases.size === 0) return str
+
+  const legend = 'classes: ' + Array.from(aliases, ([className, alias]) => `${alias}=<${className}>`).join(' ')
+  const body = str.replace(/ class=<([^>]*)>/g, (whole, className) => aliases.has(className) ? ` class=${aliases.get(className)}` : whole)
+  return `${legend}\n${body}`
+}
+
 function click_element(element: HTMLElement) {
       // element.scrollIntoView({ behavior: 'smooth', block: 'center' })
       element.focus()
@@ -73,6 +135,62 @@ function click_element(element: HTMLElement) {
       element.click()
 }
 
+function input_element(element: HTMLInputElement | HTMLTextAreaElement, content: string) {
+      element.value = content
+      element.dispatchEvent(new Event('input', {bubbles: true}))
+      element.dispatchEvent(new Event('change', {bubbles: true}))
+
+      element.dispatchEvent(new KeyboardEvent('keydown', {
+        key: 'Enter',
+        code: 'Enter',
+        bubbles: true,
+        cancelable: true
+      }))
+      element.dispatchEvent(new KeyboardEvent('keypress', {
+        key: 'Enter',
+        code: 'Enter',
+        bubbles: true,
+        cancelable: true
+      }))
+      element.dispatchEvent(new KeyboardEvent('keyup', {
+        key: 'Enter',
+        code: 'Enter',
+        bubbles: true,
+        cancelable: true
+      }))
+}
+
+interface FormOperation {
+  uid: string
+  action: 'input' | 'click' | 'select'
+  value?: string
+}
+
+function apply_operation(element: HTMLElement | undefined, operation: FormOperation): { success: boolean, data: string } {
+  if (!element) {
+    return { success: false, data: `Element ${operation.uid} not found in domMap` }
+  }
+  if (operation.action == 'click') {
+    click_element(element)
+    return { success: true, data: 'clicked' }
+  }
+  if (operation.action == 'select' && element instanceof HTMLSelectElement) {
+    const option = Array.from(element.options).find(option => option.value == operation.value || option.text.trim() == operation.value)
+    if (!option) {
+      return { success: false, data: `No option ${operation.value}` }
+    }
+    element.value = option.value
+    element.dispatchEvent(new Event('input', {bubbles: true}))
+    element.dispatchEvent(new Event('change', {bubbles: true}))
+    return { success: true, data: `selected ${option.text.trim()}` }
+  }
+  if (operation.action == 'input' && (element instanceof HTMLInputElement || element instanceof HTMLTextAreaElement)) {
+    input_element(element, operation.value ?? '')
+    return { success: true, data: `input ${operation.value ?? ''}` }
+  }
+  return { success: false, data: `Can't ${operation.action} a ${element.tagName.toLowerCase()} element` }
+}
+
 function App() {
   const [show, setShow] = useState(false)
   const toggle = () => setShow(!show)
@@ -80,6 +198,9 @@ function App() {
 
 
   const domMapRef = useRef<Record<number, HTMLElement>>({})
+  // uids persist across processPage calls for as long as the element exists
+  const uidsRef = useRef(new WeakMap<Element, number>())
+  const uidCounterRef = useRef({ value: 0 })
 
   // Test function to execute JS via background script
   const testExecuteJS = async () => {
@@ -105,9 +226,10 @@ function App() {
   useEffect(() => {
     const listener = (message: any, sender: chrome.runtime.MessageSender, sendResponse: (response?: any) => void) => {
       if (message.action == 'processPage') {
-          const { str, domMap } = processPage(document.body)
+          const { str, domMap } = processPage(document.body, 0, uidCounterRef.current, {}, uidsRef.current)
           domMapRef.current = domMap as Record<number, HTMLElement>
-          sendResponse({ success: true, data: str })
+          // header lets the server tell snapshots of the same page apart from a navigation
+          sendResponse({ success: true, data: `@page url=<${location.href}>\n${aliasClasses(str)}` })
         }
         if (message.action == 'click') {
           const element = domMapRef.current[message.uid]
@@ -122,28 +244,7 @@ function App() {
         if (message.action == 'input_tool') {
           const element = domMapRef.current[message.uid]
           if (element && element instanceof HTMLInputElement) {
-            element.value = message.content
-            element.dispatchEvent(new Event('input', {bubbles: true}))
-            element.dispatchEvent(new Event('change', {bubbles: true}))
-
-            element.dispatchEvent(new KeyboardEvent('keydown', {
-              key: 'Enter',
-              code: 'Enter',
-              bubbles: true,
-              cancelable: true
-            }))
-            element.dispatchEvent(new KeyboardEvent('keypress', {
-              key: 'Enter',
-              code: 'Enter',
-              bubbles: true,
-              cancelable: true
-            }))
-            element.dispatchEvent(new KeyboardEvent('keyup', {
-              key: 'Enter',
-              code: 'Enter',
-              bubbles: true,
-              cancelable: true
-            }))
+            input_element(element, message.content)
             sendResponse({success: true, data: `Element successfully updated with input ${message.content}`})
 
           }
@@ -151,6 +252,14 @@ function App() {
           sendResponse({success: false, data: `Element can not be found or is type input`})
 
         }
+        if (message.action == 'fillForm') {
+          // apply every operation in order and report each one, a failure doesn't stop the rest
+          const results = (message.operations as FormOperation[]).map(operation => ({
+            uid: operation.uid,
+            ...apply_operation(domMapRef.current[Number(operation.uid)], operation)
+          }))
+          sendResponse({success: results.every(result => result.success), data: JSON.stringify(results)})
+        }
         if (message.action == 'clickWithCoordinates') {
           const element = document.elementFromPoint(message.x, message.y)
           if (element && element instanceof HTMLElement) {
@@ -164,7 +273,7 @@ function App() {
           const element = domMapRef.current[message.uid]
           if (element && element instanceof HTMLElement) {
             click_element(element)
-            const {str, domMap } = processPage(element,5,{value: Object.keys(domMapRef.current).length},domMapRef.current)
+            const {str, domMap } = processPage(element,5,uidCounterRef.current,domMapRef.current,uidsRef.current)
             domMapRef.current = {...domMapRef.current,...(domMap as Record <number,HTMLElement>) }
             sendResponse({success: true, data: `Found the following new set of nested elements\n${str}`})
           }
@@ -1,5 +1,5 @@
 import {createContext, useState,useContext} from 'react';
-import { pingApi, pingToolApi, takeScreenshot } from './tools';
+import { pingApi, pingToolApi, streamToolApi, takeScreenshot } from './tools';
 
 export interface AgentMessage {
     type: string;
@@ -15,6 +15,7 @@ export interface AgentMessage {
 
 interface AgentContextType {
     sendMessage: (message: string,clearHistory: boolean, url? :string) => Promise<AgentMessage[]>;
+    streamMessage: (message: string, clearHistory: boolean, onToken: (content: string) => void, url?: string) => Promise<AgentMessage[]>;
     isLoading: boolean;
 }
 
@@ -56,8 +57,30 @@ export const AgentProvider: React.FC<{children: React.ReactNode}> = ({children})
         }
     };
 
+    const streamMessage = async (message: string, clearHistory: boolean, onToken: (content: string) => void, url?: string): Promise<AgentMessage[]> => {
+        setIsLoading(true);
+
+        try {
+            const toolResponse = await streamToolApi({
+                data: message,
+                thread_id: "1",
+                clearHistory: clearHistory
+            }, onToken, url);
+
+            return toolResponse.messages;
+        }
+        catch (error) {
+            console.log("Error with model invocation: ",error);
+            throw error;
+        }
+        finally {
+            setIsLoading(false);
+        }
+    };
+
     const value: AgentContextType = {
         sendMessage,
+        streamMessage,
         isLoading
     };
     return (
@@ -2,7 +2,7 @@
 export const takeScreenshot = async (): Promise<string> => {
     const img = await new Promise<string>((resolve, reject) => {
         chrome.tabs.captureVisibleTab(
-            { format: 'png', quality: 100 },
+            { format: 'jpeg', quality: 85 },
             (dataUrl) => {
                 if (chrome.runtime.lastError) {
                     return reject(chrome.runtime.lastError.message);
@@ -91,6 +91,59 @@ export const pingToolApi = async (payload: ToolAgentRequest, url : string = 'htt
     }
 }
 
+// Same as pingToolApi but reads the server sent events of a /stream endpoint,
+// calling onToken with each chunk of text as the model generates it
+export const streamToolApi = async (
+    payload: ToolAgentRequest,
+    onToken: (content: string) => void,
+    url: string = 'http://localhost:8000/tool_agent/stream'
+): Promise<ToolAgentResponse> => {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(payload)
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // events are separated by a blank line, keep the trailing partial event in the buffer
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+        for (const raw of events) {
+            let event = 'message';
+            let data = '';
+            for (const line of raw.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            if (!data) continue;
+            const parsed = JSON.parse(data);
+            if (event === 'token') onToken(parsed.content);
+            else if (event === 'done') return parsed as ToolAgentResponse;
+            else if (event === 'error') throw new Error(parsed.detail);
+        }
+    }
+    throw new Error('Stream ended before the agent finished');
+}
+
+// Results of browser actions that failed start with this, the server reports them to the model as tool errors
+export const TOOL_FAILED_PREFIX = '[failed] '
+
+const toolResult = (response: { success?: boolean, data: string }): string =>
+    response.success === false ? `${TOOL_FAILED_PREFIX}${response.data}` : response.data
+
 // Compute tool result on client side
 export const computeTool = async (name: string, args: Record<string, any>): Promise<string> => {
     const [tab] = await chrome.tabs.query({active: true, currentWindow: true});
@@ -103,7 +156,7 @@ export const computeTool = async (name: string, args: Record<string, any>): Prom
                     reject(chrome.runtime.lastError.message)
                 }
                 else {
-                    resolve(resposne.data)
+                    resolve(toolResult(resposne))
                 }
             })
         })
@@ -112,9 +165,11 @@ export const computeTool = async (name: string, args: Record<string, any>): Prom
 
     } else if  (name == 'input_tool') {
         return await sendMessageToTab(tab.id!,{action: "input_tool",uid: args.uid, content: args.content})
+    } else if (name === 'fill_form') {
+        return await sendMessageToTab(tab.id!, {action: 'fillForm', operations: args.operations})
     } else if (name === 'take_screenshot') {
         const screenshot = await takeScreenshot()
-        // Extract base64 from data URL (remove "data:image/png;base64," prefix)
+        // Extract base64 from data URL (remove "data:image/jpeg;base64," prefix)
         const base64 = screenshot.includes('base64,') ? screenshot.split('base64,')[1] : screenshot
 
         // Get viewport dimensions
@@ -159,7 +214,7 @@ async function sendMessageToTab(id: number, toolArgs : any) : Promise<string> {
                 return reject(chrome.runtime.lastError.message)
             }
             else {
-                return resolve(response.data)
+                return resolve(toolResult(response))
             }
         })
     })
@@ -172,6 +227,36 @@ async function sendMessageToTab(id: number, toolArgs : any) : Promise<string> {
 
 
 
+export interface PrefillMatch {
+    uid: string
+    action: 'input' | 'select'
+    value: string
+    field: string
+    source: string
+    confidence: number
+}
+
+// Fill the fields of the current page that match the uploaded resume and answers, without a model call
+export const prefillForm = async (threadId: string, url: string = 'http://localhost:8000/prefill'): Promise<{ matches: PrefillMatch[], result: string }> => {
+    const page = await computeTool('process_page', {})
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ thread_id: threadId, page })
+    });
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const data: { operations: Record<string, any>[], matches: PrefillMatch[] } = await response.json();
+    if (data.operations.length === 0) {
+        return { matches: [], result: 'No fields matched the profile' }
+    }
+    const result = await computeTool('fill_form', { operations: data.operations })
+    return { matches: data.matches, result }
+}
+
 // Send completed tool result to server
 export const sendToolResult = async (toolCallId: string, result: string): Promise<void> => {
     try {
@@ -195,4 +280,44 @@ export const sendToolResult = async (toolCallId: string, result: string): Promis
         console.error('Error sending tool result:', error);
         throw error;
     }
-}
\ No newline at end of file
+}
+// Persistent per-thread channel: the server pushes tool requests as the agent reaches them
+// and we stream the computed results back on the same connection
+export interface ToolChannel {
+    isOpen: () => boolean;
+    send: (type: 'message' | 'approve' | 'decline', data?: string) => void;
+    close: () => void;
+}
+
+export const openToolChannel = (
+    threadId: string,
+    onMessages?: (messages: ToolAgentResponse['messages'], request: string) => void,
+    url: string = 'ws://localhost:8000/ws'
+): ToolChannel => {
+    const socket = new WebSocket(`${url}/${threadId}`)
+
+    socket.onmessage = async (event) => {
+        const message = JSON.parse(event.data)
+        if (message.type === 'tool_request') {
+            const { id, name, args } = message.tool_call
+            let result: string
+            try {
+                result = await computeTool(name, args)
+            } catch (error) {
+                result = `${TOOL_FAILED_PREFIX}Error computing tool ${name}: ${String(error)}`
+            }
+            socket.send(JSON.stringify({ type: 'tool_result', tool_call_id: id, result: result }))
+        } else if (message.type === 'messages') {
+            onMessages?.(message.messages, message.request)
+        } else if (message.type === 'error') {
+            console.error('Tool channel error:', message.detail)
+        }
+    }
+    socket.onerror = (error) => console.error('Tool channel error:', error)
+
+    return {
+        isOpen: () => socket.readyState === WebSocket.OPEN,
+        send: (type, data = '') => socket.send(JSON.stringify({ type: type, data: data })),
+        close: () => socket.close()
+    }
+}
@@ -1,7 +1,7 @@
 import { useState, useRef, useEffect } from 'react'
 import { Fragment } from 'react/jsx-runtime'
 import { useAgent, AgentMessage } from '@/contexts/agentContext';
-import { computeTool, sendToolResult } from '@/contexts/tools';
+import { computeTool, sendToolResult, openToolChannel, ToolChannel, prefillForm } from '@/contexts/tools';
 
 import './App.css'
 interface Message {
@@ -24,43 +24,35 @@ export default function App() {
   const [currTools,setCurrTools] = useState<Tool[]>([])
   const [clearHistory, setClearHistory] = useState(false)
   const fileInputRef = useRef<HTMLInputElement>(null);
-  const { sendMessage, isLoading } = useAgent()
+  // which of the user's documents an upload replaces
+  const [uploadTarget, setUploadTarget] = useState<'resume' | 'application'>('resume')
+  const { sendMessage, streamMessage, isLoading } = useAgent()
+  const [streamingText, setStreamingText] = useState('')
   const chatEndRef = useRef<HTMLDivElement>(null)
+  const toolChannelRef = useRef<ToolChannel | null>(null)
 
-  const handleFileSelect = (e:React.ChangeEvent<HTMLInputElement>) => {
+  // Keep a channel open so the server can push approved tool calls as it runs them
+  useEffect(() => {
+    toolChannelRef.current = openToolChannel("1")
+    return () => toolChannelRef.current?.close()
+  }, [])
+
+  const handleFileSelect = async (e:React.ChangeEvent<HTMLInputElement>) => {
     const file = e.target.files?.[0]
     if (!file) return 
 
-    const reader = new FileReader()
-    reader.onload = async (event) => {
-      const abuffer = event.target?.result as ArrayBuffer 
-      const uint8Array = new Uint8Array(abuffer)      
-      let b64 = ''
-      const chunkSize = 8192  // Process 8KB at a time
-      for (let i = 0; i < uint8Array.length; i += chunkSize) {
-        const chunk = uint8Array.subarray(i, i + chunkSize)
-        b64 += String.fromCharCode(...chunk)
-      }
-      b64 = btoa(b64)
-
-      await send(
-        {
-          fileName: file.name,
-          filetType: file.type,
-          fileSize: file.size,
-          fileData: b64 
-        }
-      )
-    }
-    reader.readAsArrayBuffer(file)
+    const resp = await send(file)
+    if (resp.detail) setMessages(prev => [...prev, { role: 'assistant', content: `Uploading ${file.name} failed: ${resp.detail}` }])
+    if (resp.job) await waitForConversion(resp.job)
   }
 
-  const send = async (fileData: any) => {
-    const resp = await fetch("http:localhost:8000/upload_file", 
+  // The file is sent as the raw request body, the browser streams it from disk
+  const send = async (file: File) => {
+    const resp = await fetch(`http://localhost:8000/upload_file/stream?file_name=${encodeURIComponent(file.name)}&target=${uploadTarget}`, 
       {
         method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify(fileData)
+        headers: {'Content-Type': 'application/octet-stream'},
+        body: file
       }
     )
     return resp.json()
@@ -68,6 +60,20 @@ export default function App() {
   }
 
 
+  // Documents are converted to markdown on the server in the background, report when that's done
+  const waitForConversion = async (job: Record<string, any>) => {
+    while (job.status === 'queued' || job.status === 'running') {
+      await new Promise(resolve => setTimeout(resolve, 1000))
+      const resp = await fetch(`http://localhost:8000/upload_file/jobs/${job.id}`)
+      if (!resp.ok) return
+      job = await resp.json()
+    }
+    setMessages(prev => [...prev, {
+      role: 'assistant',
+      content: job.status === 'done' ? `${job.file} is ready${job.cached ? ' (converted before)' : ''}` : `Converting ${job.file} failed: ${job.error}`
+    }])
+  }
+
   // Auto-scroll to bottom when new messages arrive
   useEffect(() => {
     chatEndRef.current?.scrollIntoView({ behavior: 'smooth' })
@@ -78,7 +84,8 @@ export default function App() {
     setMessages([])
   }
   const executeTools = async (accept: boolean) => {
-    if (accept)
+    // with an open channel the server requests each tool itself once approved
+    if (accept && !toolChannelRef.current?.isOpen())
       await Promise.all(
         currTools.map(async tool => {
           const res = await computeTool(tool.name,tool.args);
@@ -86,7 +93,7 @@ export default function App() {
         })
       )
     setCurrTools([])
-    await handleSendMessage(`http://localhost:8000/${accept ? "approve" : "decline"}`)
+    await handleSendMessage(`http://localhost:8000/${accept ? "approve" : "decline"}/stream`)
   }
 
   const handleSendMessage = async (url?:string) => {
@@ -100,11 +107,15 @@ export default function App() {
 
 
     try {
-      // Call the backend API
-      const agentMessages = await sendMessage(currentInput,clearHistory,url)
+      // Call the backend API, showing the reply as it is generated
+      const agentMessages = await streamMessage(currentInput,clearHistory,
+        (content) => setStreamingText(prev => prev + content),url)
+      setStreamingText('')
 
       // Parse the agent messages and convert to UI messages
       const newMessages: Message[] = []
+      // read only tool calls may already have run without approval, only the rest wait for it
+      const answered = new Set(agentMessages.filter(msg => msg.type === 'ToolMessage').map(msg => msg.tool_call_id))
 
       for (const msg of agentMessages) {
         // Skip HumanMessage to avoid duplicating user input
@@ -115,13 +126,15 @@ export default function App() {
         if (msg.type === 'AIMessage') {
           // Handle tool calls separately
           if (msg.tool_calls && msg.tool_calls.length > 0) {
-            setCurrTools(msg.tool_calls.map(
-              (value) => ({
-                id: value.id,
-                name: value.name,
-                args: value.args
-              })
-            ))
+            const pending = msg.tool_calls.filter(value => !answered.has(value.id))
+            if (pending.length > 0)
+              setCurrTools(pending.map(
+                (value) => ({
+                  id: value.id,
+                  name: value.name,
+                  args: value.args
+                })
+              ))
 
             for (const toolCall of msg.tool_calls) {
               // Compute tool result on client
@@ -133,7 +146,9 @@ export default function App() {
 
               newMessages.push({
                 role: 'tool_call',
-                content: `Calling tool: ${toolCall.name}`,
+                content: toolCall.name === 'fill_form'
+                  ? `Filling ${toolCall.args.operations?.length ?? 0} fields in one batch`
+                  : `Calling tool: ${toolCall.name}`,
                 toolName: toolCall.name,
                 toolArgs: toolCall.args
               })
@@ -165,6 +180,22 @@ export default function App() {
       }
 
       setMessages(prev => [...prev, errorMessage])
+      setStreamingText('')
+    }
+  }
+
+  // Fill what the resume and answers already cover, the agent only has to deal with the rest
+  const autofill = async () => {
+    try {
+      const { matches, result } = await prefillForm("1")
+      setMessages(prev => [...prev, {
+        role: 'tool_call',
+        content: matches.length ? `Autofilled ${matches.length} fields` : result,
+        toolName: 'fill_form',
+        toolArgs: { operations: matches }
+      }])
+    } catch (error) {
+      setMessages(prev => [...prev, { role: 'assistant', content: `Autofill failed: ${error}` }])
     }
   }
 
@@ -189,7 +220,16 @@ export default function App() {
               <div key={index} className={`message ${message.role}`}>
                 <div className='message_content'>
                   {message.content}
-                  {message.role === 'tool_call' && message.toolArgs && (
+                  {message.role === 'tool_call' && message.toolName === 'fill_form' && message.toolArgs && (
+                    <div className='tool_args'>
+                      <ul>
+                        {(message.toolArgs.operations ?? []).map((operation: Record<string, any>, i: number) => (
+                          <li key={i}>{operation.action} &lt;{operation.uid}&gt;{operation.value !== undefined && operation.value !== null ? `: ${operation.value}` : ''}</li>
+                        ))}
+                      </ul>
+                    </div>
+                  )}
+                  {message.role === 'tool_call' && message.toolName !== 'fill_form' && message.toolArgs && (
                     <div className='tool_args'>
                       <strong>Arguments:</strong>
                       <pre>{JSON.stringify(message.toolArgs, null, 2)}</pre>
@@ -198,7 +238,12 @@ export default function App() {
                 </div>
               </div>
             ))}
-            {isLoading && (
+            {isLoading && streamingText && (
+              <div className='message assistant'>
+                <div className='message_content'>{streamingText}</div>
+              </div>
+            )}
+            {isLoading && !streamingText && (
               <div className='message assistant'>
                 <div className='message_content typing'>
                   <span></span>
@@ -262,12 +307,36 @@ export default function App() {
         >
           Clear
         </button>
+        <button
+          onClick={autofill}
+          disabled={isLoading}
+          style={{
+            border: 'none',
+            fontSize: '20px',
+            padding: '0',
+            display: 'flex',
+            alignItems: 'center',
+            justifyContent: 'center',
+            color: '#000'
+          }}
+        >
+          Autofill
+        </button>
       </div>
       <div style={{
         padding: '12px 16px',
         background: '#ffffff',
-        borderTop: '1px solid #d2d2d7'
+        borderTop: '1px solid #d2d2d7',
+        display: 'flex',
+        gap: '8px'
       }}>
+        <select
+          value={uploadTarget}
+          onChange={(e) => setUploadTarget(e.target.value as 'resume' | 'application')}
+        >
+          <option value='resume'>Resume</option>
+          <option value='application'>Application answers</option>
+        </select>
         <input
           ref={fileInputRef}
           onChange={handleFileSelect}